@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+"""
+Write and read back JSON cache entries with each codec, and report the
+effective capacity (logical bytes per byte on disk) against throughput.
+
+    python benchmarks/cache_codecs.py [entries] [records]
+"""
+
+from pathlib import Path
+import cfgs
+import json
+import random
+import sys
+import tempfile
+import time
+
+SEED = 23
+
+
+def entry(rnd, records):
+    return json.dumps([
+        {
+            'id': rnd.randrange(1 << 30),
+            'name': 'item-%d' % rnd.randrange(1000),
+            'tags': rnd.sample(['red', 'green', 'blue', 'large', 'small'], 2),
+            'score': round(rnd.random(), 4),
+        }
+        for i in range(records)
+    ]).encode()
+
+
+def run(codec, entries):
+    with tempfile.TemporaryDirectory() as root:
+        dirname = str(Path(root, 'cache'))
+        cache = cfgs.CacheDirectory(dirname, 0, codec=codec)
+
+        start = time.perf_counter()
+        for i, e in enumerate(entries):
+            with cache.open('e%d' % i, binary=True) as fp:
+                fp.write(e)
+        write = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for i, e in enumerate(entries):
+            with cache.open('e%d' % i, binary=True) as fp:
+                assert fp.read() == e
+        read = time.perf_counter() - start
+
+        return cache.index.total, write, read
+
+
+def main(count=200, records=200):
+    rnd = random.Random(SEED)
+    entries = [entry(rnd, int(records)) for i in range(int(count))]
+    logical = sum(len(e) for e in entries)
+    mb = logical / 1000000
+
+    titles = 'codec', 'capacity', 'write MB/s', 'read MB/s'
+    print('%-6s %9s %11s %10s' % titles)
+    for codec in [None] + sorted(cfgs.CACHE_CODECS):
+        disk, write, read = run(codec, entries)
+        row = codec or 'none', logical / disk, mb / write, mb / read
+        print('%-6s %8.2fx %11.1f %10.1f' % row)
+
+
+if __name__ == '__main__':
+    main(*sys.argv[1:])
@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+"""
+Replay a synthetic Zipf workload against a `cfgs.CacheDirectory` with each
+eviction policy, and report the hit ratio and the cost of pruning.
+
+    python benchmarks/cache_policies.py [requests] [keys] [cache_size]
+"""
+
+from pathlib import Path
+import cfgs
+import itertools
+import random
+import sys
+import tempfile
+import time
+
+ZIPF_S = 1.1
+SEED = 23
+
+
+def workload(requests, keys):
+    rnd = random.Random(SEED)
+    zipf = (1 / (i + 1) ** ZIPF_S for i in range(keys))
+    weights = list(itertools.accumulate(zipf))
+    sizes = [rnd.randint(64, 4096) for _ in range(keys)]
+    names = rnd.choices(range(keys), cum_weights=weights, k=requests)
+    return [('k%d' % i, sizes[i]) for i in names]
+
+
+def replay(policy, requests, cache_size):
+    with tempfile.TemporaryDirectory() as root:
+        cache = cfgs.CacheDirectory(
+            str(Path(root, 'cache')), cache_size, policy
+        )
+        prune, prune_time = cache.prune, 0
+
+        def timed_prune(*args):
+            nonlocal prune_time
+            t = time.perf_counter()
+            prune(*args)
+            prune_time += time.perf_counter() - t
+
+        cache.prune = timed_prune
+        hits = 0
+        start = time.perf_counter()
+        for name, size in requests:
+            fp = cache.open(name, size_guess=size, binary=True)
+            if 'r' in fp.mode:
+                hits += 1
+            else:
+                fp.write(b'x' * size)
+            fp.close()
+
+        total = time.perf_counter() - start
+        return hits / len(requests), prune_time, total
+
+
+def main(requests=20000, keys=5000, cache_size=1000000):
+    reqs = workload(int(requests), int(keys))
+    titles = 'policy', 'hit ratio', 'prune (ms)', 'total (s)'
+    print('%-6s %9s %12s %10s' % titles)
+    for name in sorted(cfgs.CACHE_POLICIES):
+        ratio, prune_time, total = replay(name, reqs, int(cache_size))
+        row = name, ratio, 1000 * prune_time, total
+        print('%-6s %9.3f %12.1f %10.2f' % row)
+
+
+if __name__ == '__main__':
+    main(*sys.argv[1:])
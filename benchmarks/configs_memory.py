@@ -0,0 +1,47 @@
+#!/usr/bin/env python
+"""
+Measure the memory used by each instance of a small Configs class, and by
+its slotted variant.
+
+    python benchmarks/configs_memory.py [instances]
+"""
+
+import cfgs
+import dataclasses as dc
+import sys
+import tracemalloc
+
+
+@dc.dataclass
+class Midi(cfgs.Configs):
+    channel: int = 0
+    name: str = ''
+    enabled: bool = True
+
+
+@dc.dataclass
+class Device(cfgs.Configs):
+    midi: Midi = dc.field(default_factory=Midi)
+    port: int = 0
+
+
+def per_instance(cls, instances):
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    kept = [cls() for i in range(instances)]
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    assert len(kept) == instances
+    return (after - before - sys.getsizeof(kept)) / instances
+
+
+def main(instances=100000):
+    for cls in Midi, Device:
+        for variant in cls, cls.slotted():
+            size = per_instance(variant, instances)
+            kind = 'slotted' if variant is not cls else 'dataclass'
+            print('%-7s %-10s %6.1f bytes' % (cls.__name__, kind, size))
+
+
+if __name__ == '__main__':
+    main(*(int(a) for a in sys.argv[1:]))
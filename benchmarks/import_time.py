@@ -0,0 +1,51 @@
+#!/usr/bin/env python
+"""
+Measure how long `import cfgs` takes with `python -X importtime`, and fail
+if the median is over budget.
+
+    python benchmarks/import_time.py [budget_us] [runs]
+"""
+
+from pathlib import Path
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = str(Path(__file__).parents[1])
+CODE = 'import cfgs; cfgs.App("import-time")'
+
+
+def import_time():
+    cmd = sys.executable, '-X', 'importtime', '-c', CODE
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    env.pop('PYTHONDONTWRITEBYTECODE', None)
+    lines = subprocess.run(
+        cmd, env=env, stderr=subprocess.PIPE, text=True, check=True
+    ).stderr.splitlines()
+
+    times = {}
+    for line in lines:
+        if line.startswith('import time:') and '|' in line:
+            _, cumulative, name = line.split('|')
+            if cumulative.strip().isdigit():
+                times[name.strip()] = int(cumulative)
+    return times
+
+
+def main(budget_us=5000, runs=11):
+    import_time()  # Write the .pyc files
+    runs = [import_time() for i in range(int(runs))]
+    median = statistics.median(r['cfgs'] for r in runs)
+    print('import cfgs: median %d us, budget %d us' % (median, budget_us))
+
+    slowest = sorted(runs[-1].items(), key=lambda x: -x[1])
+    for name, us in slowest[:8]:
+        print('  %8d us  %s' % (us, name))
+
+    if median > int(budget_us):
+        sys.exit('Over budget')
+
+
+if __name__ == '__main__':
+    main(*sys.argv[1:])
@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+"""
+Parse and serialize the same document with every installed parser backend,
+and report throughput in MB/s.
+
+    python benchmarks/parser_backends.py [records] [repeats]
+"""
+
+import cfgs
+import random
+import sys
+import time
+
+SEED = 23
+
+
+def document(records):
+    rnd = random.Random(SEED)
+    return {
+        'item%d' % i: {
+            'id': rnd.randrange(1 << 30),
+            'name': 'item-%d' % rnd.randrange(1000),
+            'tags': rnd.sample(['red', 'green', 'blue', 'large', 'small'], 2),
+            'score': round(rnd.random(), 4),
+            'enabled': rnd.random() < 0.5,
+        }
+        for i in range(records)
+    }
+
+
+def best(function, arg, repeats):
+    times = []
+    for i in range(repeats):
+        start = time.perf_counter()
+        function(arg)
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def main(records=2000, repeats=5):
+    contents = document(int(records))
+    print('%-6s %-10s %12s %12s' % ('format', 'backend', 'parse MB/s',
+                                    'write MB/s'))
+
+    for format, backends in cfgs.PARSER_BACKENDS.items():
+        try:
+            text = cfgs.parser_backend(format, write=True).dumps(contents)
+        except ImportError as e:
+            print('%-6s %s' % (format, e))
+            continue
+        megabytes = len(text.encode()) / 1e6
+
+        if format == 'json':
+            backends = backends + [cfgs.OrjsonBackend()]  # Not a default
+        for backend in backends:
+            if not backend.available():
+                continue
+            rates = []
+            if backend.can_load:
+                rates.append(megabytes / best(backend.loads, text, repeats))
+            else:
+                rates.append(None)
+            if backend.can_dump:
+                dumps = backend.dumps
+                rates.append(megabytes / best(dumps, contents, repeats))
+            else:
+                rates.append(None)
+
+            cells = ['%12.1f' % r if r else '%12s' % '-' for r in rates]
+            print('%-6s %-10s %s' % (format, backend.name, ' '.join(cells)))
+
+
+if __name__ == '__main__':
+    main(*(int(a) for a in sys.argv[1:]))
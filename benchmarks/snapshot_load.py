@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+"""
+Load a large Configs tree from JSON and from a binary snapshot, the way a
+process does at cold start, and report the time for each.
+
+    python benchmarks/snapshot_load.py [sections] [fields] [repeats]
+"""
+
+from pathlib import Path
+import cfgs
+import dataclasses as dc
+import json
+import sys
+import tempfile
+import time
+
+
+def make_configs(sections, fields):
+    section = dc.make_dataclass(
+        'Section',
+        [('f%d' % i, int, dc.field(default=i)) for i in range(fields)],
+        bases=(cfgs.Configs,),
+    )
+    return dc.make_dataclass(
+        'Tree',
+        [('s%d' % i, section, dc.field(default_factory=section))
+         for i in range(sections)],
+        bases=(cfgs.Configs,),
+    )
+
+
+def best(function, repeats):
+    times = []
+    for i in range(repeats):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def main(sections=100, fields=50, repeats=7):
+    Tree = make_configs(sections, fields)
+    configs = Tree()
+    for i, address in enumerate(cfgs._plan(Tree).paths):
+        cfgs._accessors(address).set(configs, i * 7)
+
+    with tempfile.TemporaryDirectory() as root:
+        text = Path(root, 'tree.json')
+        text.write_text(json.dumps(dc.asdict(configs)))
+        snap = Path(root, 'tree.snap')
+        snap.write_bytes(configs.snapshot())
+
+        def load(path):
+            cfgs._PARSED.clear()  # Cold start: nothing cached yet
+            Tree().load(path)
+
+        for path in text, snap:
+            seconds = best(lambda: load(path), repeats)
+            print('%-10s %8d bytes %8.2f ms' % (
+                path.name, path.stat().st_size, seconds * 1000))
+
+
+if __name__ == '__main__':
+    main(*(int(a) for a in sys.argv[1:]))
@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+"""
+Compare the peak RSS of reading a large data file with `cfgs.File` against
+streaming it with `cfgs.Directory.stream`, each in a fresh process.
+
+    python benchmarks/stream_memory.py [records]
+"""
+
+from pathlib import Path
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+ROOT = str(Path(__file__).parents[1])
+
+READ = '''
+import cfgs, resource, sys
+data = cfgs.App('bench', format=sys.argv[1]).data
+{body}
+print(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, total)
+'''
+
+CASES = {
+    'File.read (json)': (
+        'json', 'total = sum(len(v) for v in data.open().contents.values())'
+    ),
+    'stream (json)': (
+        'json', 'total = sum(len(v) for k, v in data.stream())'
+    ),
+    'stream (jsonl)': (
+        'jsonl', 'total = sum(len(v) for k, v in data.stream())'
+    ),
+    'File.read (yaml)': (
+        'yaml', 'total = sum(len(v) for v in data.open().contents.values())'
+    ),
+    'stream (yaml)': (
+        'yaml', 'total = sum(len(v) for k, v in data.stream())'
+    ),
+}
+
+
+def record(i):
+    return {'id': i, 'name': 'item-%d' % i, 'tags': ['a', 'b', 'c'] * 3}
+
+
+def main(records=200000):
+    with tempfile.TemporaryDirectory() as root:
+        directory = Path(root, 'bench')
+        directory.mkdir()
+        # Write the files piece by piece: child processes inherit peak RSS
+        with open(directory / 'bench.json', 'w') as fp:
+            fp.write('{')
+            for i in range(records):
+                fp.write('%s"k%d": %s' % (
+                    ', ' if i else '', i, json.dumps(record(i))))
+            fp.write('}')
+        with open(directory / 'bench.jsonl', 'w') as fp:
+            for i in range(records):
+                fp.write(json.dumps(['k%d' % i, record(i)]) + '\n')
+        with open(directory / 'bench.yml', 'w') as fp:
+            for i in range(records):
+                fp.write('k%d: %s\n' % (i, json.dumps(record(i))))
+
+        env = dict(os.environ, PYTHONPATH=ROOT, XDG_DATA_HOME=root)
+        size = (directory / 'bench.json').stat().st_size / 1e6
+        print('%d records, %.1f MB of JSON' % (records, size))
+
+        for name, (format, body) in CASES.items():
+            code = READ.format(body=body)
+            out = subprocess.run(
+                [sys.executable, '-c', code, format],
+                env=env, stdout=subprocess.PIPE, text=True, check=True,
+            ).stdout.split()
+            print('%-18s peak RSS %7.1f MB' % (name, int(out[0]) / 1024))
+
+
+if __name__ == '__main__':
+    main(*(int(a) for a in sys.argv[1:]))
@@ -7,94 +7,598 @@ Simple, correct handling of config, data and cache files.
 Fully compliant with the XDG Base Directory Specification.
 """
 
-from enum import Enum
-from pathlib import Path
-from typing import Any, Dict, Optional, Tuple, Union
-import copy
-import dataclasses as dc
-import json
-import os
+from __future__ import annotations
 import os
 import sys
+import time
+
+
+class _Lazy:
+    """
+    A placeholder for a module which is only imported when one of its
+    attributes is first used, and then replaces the placeholder, so that
+    `import cfgs` stays fast
+    """
+
+    def __init__(self, name, alias=None):
+        self._name = name
+        self._alias = alias or name
+
+    def __getattr__(self, attr):
+        module = __import__(self._name)
+        globals()[self._alias] = module
+        return getattr(module, attr)
+
+
+collections = _Lazy('collections')
+copy = _Lazy('copy')
+dc = _Lazy('dataclasses', 'dc')
+enum = _Lazy('enum')
+functools = _Lazy('functools')
+hashlib = _Lazy('hashlib')
+heapq = _Lazy('heapq')
+json = _Lazy('json')
+threading = _Lazy('threading')
+types = _Lazy('types')
+typing = _Lazy('typing')
 
-File = Tuple[Union[Path, str]]
 _NONE = object()
 
+_metrics = None
+"""The `cfgs.metrics.Metrics` that is recording, set by `cfgs.metrics`"""
+
 
 class Configs:
-    def diff(self, other: Any):
-        assert self.__class__ is other.__class__
-        result = {}
-        for f in dc.fields(self):
-            s, o = getattr(self, f.name), getattr(other, f.name)
-            if s != o:
-                if isinstance(s, Configs):
-                    assert isinstance(o, Configs)
-                    o = s.diff(o)
-                result[f.name] = o
+    __slots__ = ()
 
-        return result
+    @classmethod
+    def slotted(cls):
+        """
+        Return a variant of this class which uses `__slots__` instead of a
+        per-instance `__dict__`, for keeping many instances in memory.
+        Nested `cfgs.Configs` fields use slotted variants too.
 
-    def copy_from(self, **kwargs):
+        The variant has the same fields and methods, and `super()` works in
+        them, but it is a subclass of the variants of this class's bases,
+        and not of this class itself.
+        """
+        return _variant(cls, 'slotted')
+
+    def freeze(self):
+        """
+        Return an immutable copy of this tree, using frozen, slotted
+        variants of each class, and leaf values from `cfgs.freeze_data`.
+        Freezing a frozen tree returns it unchanged
+        """
+        if getattr(self, '_cfgs_variant', None) == 'frozen':
+            return self
+        cls = _variant(type(self), 'frozen')
+
+        def freeze(name, value):
+            return freeze_data(value)
+
+        return _rebuild(self, cls, Configs.freeze, freeze)
+
+    def thaw(self):
+        """
+        Return a mutable copy of this tree, in the original classes, with
+        mutable leaf values
+        """
+        cls = getattr(type(self), '_cfgs_origin', type(self))
+        try:
+            hints = typing.get_type_hints(cls)
+        except Exception:
+            hints = {}
+
+        def thaw_data(name, value):
+            return _thaw_data(value, hints.get(name))
+
+        return _rebuild(self, cls, Configs.thaw, thaw_data)
+
+    def evolve(self, **kwargs):
+        """
+        Return a frozen copy of this tree with values set like `copy_from`.
+
+        Only the nodes on the path to each changed field are copied: all
+        the other nodes are shared with this tree, which is unchanged
+        """
+        frozen = self.freeze()
+        kinds = _plan(type(frozen)).kinds
+        changes = {}
         for k, v in kwargs.items():
-            attr = getattr(self, k)
-            if isinstance(attr, Configs):
-                attr.copy_from(**v)
+            if k not in kinds:
+                raise AttributeError(k)
+            child = getattr(frozen, k)
+            if isinstance(child, Configs) and isinstance(v, dict):
+                changes[k] = child.evolve(**v)
             else:
-                setattr(self, k, v)
+                changes[k] = freeze_data(v, child)
+        return dc.replace(frozen, **changes)
+
+    def diff(self, other: Configs):
+        assert self.__class__ is other.__class__
+        return _plan(type(self)).diff(self, other)
+
+    def copy_from(self, **kwargs):
+        setters = _plan(type(self)).setters
+        for k, v in kwargs.items():
+            try:
+                setter = setters[k]
+            except KeyError:
+                raise AttributeError(k) from None
+            setter(self, v)
 
-    def load(self, *files: File):
+    def load(self, *files: str | os.PathLike):
         for f in files:
-            self.copy_from(_load(f))
+            if os.fspath(f).endswith(FORMAT_TO_SUFFIX['snapshot']):
+                with open(f, 'rb') as fp:
+                    self.load_snapshot(fp.read())
+            else:
+                self.copy_from(**_load(f))
+
+    def snapshot(self) -> bytes:
+        """Return every leaf value as a compact binary snapshot"""
+        if getattr(self, '_cfgs_variant', None) == 'frozen':
+            return self.thaw().snapshot()
+        plan = _plan(type(self))
+        values = plan.values(self)
+        if plan.enums:
+            # Enums are stored by name
+            values = list(values)
+            for i, _ in plan.enums:
+                if isinstance(values[i], enum.Enum):
+                    values[i] = values[i].name
+            values = tuple(values)
+        return _snapshot_dumps(plan.version, values)
+
+    def load_snapshot(self, data: bytes):
+        """
+        Set every leaf value from `cfgs.Configs.snapshot`, or raise a
+        ValueError if the snapshot was made for a different schema
+        """
+        plan = _plan(type(self))
+        values = _snapshot_loads(data, plan.version)
+        if len(values) != len(plan.paths):
+            raise ValueError('Snapshot has the wrong number of fields')
+        if plan.enums:
+            values = list(values)
+            for i, cls in plan.enums:
+                if isinstance(values[i], str):
+                    try:
+                        values[i] = cls[values[i]]
+                    except KeyError:
+                        msg = 'Snapshot has an unknown %s: %s'
+                        name = cls.__name__
+                        raise ValueError(msg % (name, values[i])) from None
+        plan.restore(self, values)
 
     def load_from_environ(
         self,
         prefix: str,
-        environ: Optional[Dict] = None,
+        environ: dict | None = None,
         verbose: bool = True,
     ):
         if environ is None:
             environ = os.environ
         pre = prefix.strip('_').upper() + '_'
-        items = sorted(environ.items())
-        items = ((k, v) for k, v in items if k.startswith(pre))
-
-        for k, v in items:
-            attr_name = k[len(pre):].lower()
-            splits = list(_split_address(v, attr_name))
-            if len(splits) == 1:
-                parent, attr = splits[0]
-                str_val = getattr(parent, attr)
-                val = _string_value(k, v, str_val)
-                setattr(parent, attr, val)
+        plan = _plan(type(self))
+        table = plan.environ_table(pre)
+
+        # One dict lookup per variable, without sorting or filtering first
+        for k, v in environ.items():
+            address = table.get(k, _NONE)
+            if address is _NONE:
+                if not k.startswith(pre):
+                    continue
+                address = plan.environ.get(k[len(pre):].lower(), _NONE)
+
+            if address is not _NONE and address is not None:
+                value = _string_value(k, v, address.get(self))
+                address.set(self, value)
             elif not verbose:
                 continue
-            elif not splits:
-                print('No configs match', k, file=sys.err)
+            elif address is _NONE:
+                print('No configs match', k, file=sys.stderr)
             else:
-                print('More than one config matches', k, file=sys.err)
+                print('More than one config matches', k, file=sys.stderr)
 
 
-def _split_address(parent, key):
-    if key in dir(parent):
-        yield parent, key
-    else:
-        for k in dir(parent):
-            if k.startswith(key + '_'):
-                k = key[len(key) + 1:]
-                new_parent = getattr(parent, k)
-                yield from _split_address(new_parent, k)
+def _variant(cls, variant):
+    cls = cls.__dict__.get('_cfgs_origin', cls)
+    name = '_cfgs_' + variant
+    try:
+        return cls.__dict__[name]
+    except KeyError:
+        pass
+
+    try:
+        hints = typing.get_type_hints(cls)
+    except Exception:
+        hints = {}
+
+    fields = []
+    for f in dc.fields(cls):
+        t = hints.get(f.name, f.type)
+        factory = f.default_factory
+        if isinstance(t, type) and issubclass(t, Configs):
+            v = _variant(t, variant)
+            t, factory = v, v if factory is t else factory
+        field = dc.field(
+            default=f.default, default_factory=factory, init=f.init,
+            repr=f.repr, hash=f.hash, compare=f.compare,
+            metadata=f.metadata, kw_only=f.kw_only,
+        )
+        fields.append((f.name, t, field))
+
+    # Dataclass bases become variants too, so `super()` finds their methods
+    bases, mixins = [], []
+    for base in cls.__bases__:
+        if issubclass(base, Configs) and dc.is_dataclass(base):
+            bases.append(_variant(base, variant))
+        elif base is not Configs:
+            mixins.append(base)
+    bases = bases or [Configs]
+
+    # Keep methods and properties, but not the dataclass machinery
+    skip = {f.name for f in dc.fields(cls)}.union(_DATACLASS_NAMES)
+    namespace = {}
+    for base in reversed(mixins):
+        for b in reversed(base.__mro__):
+            if b not in (object, Configs):
+                namespace.update(vars(b))
+    namespace.update(vars(cls))
+    cells = []
+    namespace = {
+        k: _rebind(v, cells) for k, v in namespace.items()
+        if k not in skip and not k.startswith('__dataclass')
+    }
+    namespace.update(
+        _cfgs_origin=cls, _cfgs_variant=variant, __reduce_ex__=_reduce_variant
+    )
+
+    params = cls.__dataclass_params__
+    result = dc.make_dataclass(
+        cls.__name__, fields, bases=tuple(bases), namespace=namespace,
+        init=params.init, repr=params.repr, eq=params.eq,
+        order=params.order, unsafe_hash=params.unsafe_hash,
+        frozen=params.frozen or variant == 'frozen', slots=True,
+    )
+    result.__module__ = cls.__module__
+    result.__qualname__ = cls.__qualname__
+    for cell in cells:
+        cell.cell_contents = result
+    setattr(cls, name, result)
+    return result
+
+
+def _rebind(value, cells):
+    # Copy a method whose `super()` or `__class__` refers to its class, so
+    # that they refer to the variant instead, which is set in `cells` later
+    if isinstance(value, (classmethod, staticmethod)):
+        func = _rebind(value.__func__, cells)
+        return value if func is value.__func__ else type(value)(func)
+
+    if isinstance(value, property):
+        old = [value.fget, value.fset, value.fdel]
+        funcs = [_rebind(f, cells) for f in old]
+        if funcs == old:
+            return value
+        return property(*funcs, value.__doc__)
+
+    code = getattr(value, '__code__', None)
+    if not isinstance(value, types.FunctionType) or (
+        '__class__' not in code.co_freevars
+    ):
+        return value
+
+    closure = list(value.__closure__)
+    cell = types.CellType()
+    closure[code.co_freevars.index('__class__')] = cell
+    cells.append(cell)
+
+    func = types.FunctionType(
+        code, value.__globals__, value.__name__, value.__defaults__,
+        tuple(closure),
+    )
+    func.__kwdefaults__ = value.__kwdefaults__
+    func.__dict__.update(value.__dict__)
+    for attr in '__qualname__', '__doc__', '__module__', '__annotations__':
+        setattr(func, attr, getattr(value, attr))
+    return func
+
+
+def _rebuild(configs, cls, convert, convert_data):
+    kwargs = {}
+    for f in dc.fields(configs):
+        if f.init:
+            v = getattr(configs, f.name)
+            if isinstance(v, Configs):
+                kwargs[f.name] = convert(v)
+            else:
+                kwargs[f.name] = convert_data(f.name, v)
+    return cls(**kwargs)
+
+
+def _thaw_data(value, hint=None):
+    # The inverse of freeze_data: `hint`, the type of a field, decides if a
+    # tuple or frozenset stays as it is
+    origin = typing.get_origin(hint) or hint
+    if isinstance(value, (dict, types.MappingProxyType)):
+        return {k: _thaw_data(v) for k, v in value.items()}
+    if type(value) in (list, tuple):
+        items = [_thaw_data(v) for v in value]
+        return tuple(items) if origin is tuple else items
+    if type(value) in (set, frozenset):
+        return frozenset(value) if origin is frozenset else set(value)
+    return copy.deepcopy(value)
+
+
+class Versioned:
+    """
+    Hold the current version of a `cfgs.Configs` tree, frozen, so that it
+    can be handed to any number of readers without copying it.
+
+    Changes are made with `copy_from`, which builds a new version that
+    shares every unchanged node with the old one.  The new version is only
+    published when it is complete, so readers in other threads see either
+    the old version or the new one, never a partial change.
+    """
+
+    def __init__(self, configs: Configs):
+        self.current = configs.freeze()
+        """The current, frozen version of the tree"""
+
+        self._lock = threading.Lock()
+
+    def copy_from(self, **kwargs):
+        """Publish a new version with values set, and return it"""
+        with self._lock:
+            self.current = self.current.evolve(**kwargs)
+            return self.current
+
+
+def freeze_data(value, previous=None):
+    """
+    Return an immutable copy of plain data: dicts become read-only
+    mappings, lists become tuples and sets become frozensets.
+
+    Any part that is equal to the same part of `previous`, an earlier
+    result of `freeze_data`, is shared with it rather than copied
+    """
+    if isinstance(value, dict):
+        is_old = isinstance(previous, types.MappingProxyType)
+        old = previous if is_old else {}
+        d = {k: freeze_data(v, old.get(k)) for k, v in value.items()}
+        same = is_old and len(d) == len(old) and all(
+            old.get(k, _NONE) is v for k, v in d.items()
+        )
+        return previous if same else types.MappingProxyType(d)
+
+    if isinstance(value, (list, tuple)):
+        is_old = isinstance(previous, tuple)
+        old = previous if is_old else ()
+        t = tuple(
+            freeze_data(v, old[i] if i < len(old) else None)
+            for i, v in enumerate(value)
+        )
+        same = is_old and len(t) == len(old) and all(
+            a is b for a, b in zip(t, old)
+        )
+        return previous if same else t
+
+    if isinstance(value, (set, frozenset)):
+        value = frozenset(value)
+
+    if type(value) is type(previous) and value == previous:
+        return previous
+    return value
+
+
+_DATACLASS_NAMES = {
+    '__annotations__', '__delattr__', '__dict__', '__eq__', '__ge__',
+    '__getstate__', '__gt__', '__hash__', '__init__', '__le__', '__lt__',
+    '__match_args__', '__repr__', '__setattr__', '__setstate__',
+    '__slots__', '__weakref__', '_cfgs_frozen', '_cfgs_plan',
+    '_cfgs_slotted',
+}
+
+
+def _reduce_variant(self, protocol):
+    # Pickle would find the original class by name, so go through it
+    if self._cfgs_variant == 'frozen':
+        # Read-only mappings cannot be pickled
+        return Configs.freeze, (self.thaw(),)
+    state = object.__reduce_ex__(self, max(protocol, 2))[2]
+    return _new_variant, (self._cfgs_origin, self._cfgs_variant), state
+
+
+def _new_variant(cls, variant):
+    result = _variant(cls, variant)
+    return result.__new__(result)
+
+
+def _plan(cls):
+    # Look in the class's own __dict__, so subclasses get their own plan
+    try:
+        return cls.__dict__['_cfgs_plan']
+    except KeyError:
+        plan = _Plan(cls)
+        setattr(cls, '_cfgs_plan', plan)
+        return plan
+
+
+class _Plan:
+    """
+    The fields of a `cfgs.Configs` class, compiled once into functions so
+    that `diff`, `copy_from` and `load_from_environ` need no reflection.
+
+    A field is nested if its type annotation is a `cfgs.Configs` class.
+    Fields with no useful annotation, like `Any`, are checked at runtime.
+    """
+
+    def __init__(self, cls):
+        try:
+            hints = typing.get_type_hints(cls)
+        except Exception:
+            hints = {}
+
+        fields = [
+            (f.name, _kind(hints.get(f.name, f.type))) for f in dc.fields(cls)
+        ]
+
+        self.kinds = dict(fields)
+        """
+        Map each field name to its `cfgs.Configs` class if it is nested, or
+        to `'leaf'`, or to `'any'` if it has to be checked at runtime
+        """
+
+        self.paths = []
+        """A flat list of the address of every leaf field, as a tuple"""
+
+        self.schema = []
+        """The address and type of every leaf field, as strings"""
+
+        self.enums = []
+        """The index in `paths` and the class of every `enum.Enum` field"""
+
+        for name, kind in fields:
+            if isinstance(kind, type):
+                child, offset = _plan(kind), len(self.paths)
+                self.enums.extend((offset + i, e) for i, e in child.enums)
+                self.paths.extend((name,) + p for p in child.paths)
+                self.schema.extend(
+                    (name + '.' + a, t) for a, t in child.schema
+                )
+            else:
+                t = hints.get(name, name)
+                if isinstance(t, type) and issubclass(t, enum.Enum):
+                    self.enums.append((len(self.paths), t))
+                self.paths.append((name,))
+                self.schema.append((name, getattr(t, '__qualname__', str(t))))
+
+        # Slotted variants share snapshots with the class they came from
+        origin = cls.__dict__.get('_cfgs_origin', cls)
+        schema = repr([origin.__module__, origin.__qualname__, self.schema])
+        self.version = hashlib.sha1(schema.encode()).hexdigest()[:16]
+        """A hash of the schema, which changes if any leaf field changes"""
+
+        self.environ = {}
+        """
+        Map the lowercase, underscore-joined address of each leaf field to
+        its path, getter and setter, or to None if more than one field has
+        that name
+        """
+
+        for path in self.paths:
+            name = '_'.join(path)
+            accessors = None if name in self.environ else _accessors(path)
+            self.environ[name] = accessors
+
+        self.ambiguous = sorted(k for k, v in self.environ.items() if not v)
+        """Names that match more than one field"""
+
+        self._tables = {}
+
+        diff = ['def diff(self, other):', '    result = {}']
+        setters = []
+        for name, kind in fields:
+            diff += [
+                f'    s, o = self.{name}, other.{name}',
+                '    if s != o:',
+            ]
+            if kind == 'leaf':
+                diff.append(f'        result[{name!r}] = o')
+                setters.append(f'def set_{name}(self, v): self.{name} = v')
+            elif kind == 'any':
+                diff.append(
+                    f'        result[{name!r}] = '
+                    's.diff(o) if isinstance(s, Configs) else o'
+                )
+                setters += [
+                    f'def set_{name}(self, v):',
+                    f'    a = self.{name}',
+                    '    if isinstance(a, Configs):',
+                    '        a.copy_from(**v)',
+                    '    else:',
+                    f'        self.{name} = v',
+                ]
+            else:
+                diff.append(f'        result[{name!r}] = s.diff(o)')
+                setters.append(
+                    f'def set_{name}(self, v): self.{name}.copy_from(**v)'
+                )
+        diff.append('    return result')
+
+        leaves = ', '.join('self.' + '.'.join(p) for p in self.paths)
+        snapshot = [
+            f'def values(self): return ({leaves}{"," if leaves else ""})',
+            'def restore(self, values):',
+            f'    {leaves} = values' if leaves else '    pass',
+        ]
+
+        functions = _compile(diff + setters + snapshot)
+        self.diff = functions['diff']
+        """Return the `cfgs.Configs.diff` of two instances"""
+
+        self.setters = {n: functions['set_' + n] for n, _ in fields}
+        """Map each field name to a function that sets it from a value"""
+
+        self.values = functions['values']
+        """Return a tuple of the value of each leaf field, in `paths` order"""
+
+        self.restore = functions['restore']
+        """Set every leaf field from a tuple like the one `values` returns"""
+
+    def environ_table(self, prefix):
+        """
+        Return a dict like `environ`, but keyed by the full, upper case names
+        of environment variables starting with `prefix`
+        """
+        try:
+            return self._tables[prefix]
+        except KeyError:
+            table = {prefix + k.upper(): v for k, v in self.environ.items()}
+            return self._tables.setdefault(prefix, table)
+
+
+def _kind(t):
+    if isinstance(t, type):
+        return t if issubclass(t, Configs) else 'leaf'
+    if typing.get_origin(t) in (list, dict, set, tuple):
+        return 'leaf'
+    return 'any'
+
+
+def _accessors(path):
+    address = '.'.join(path)
+    functions = _compile([
+        f'def get(self): return self.{address}',
+        f'def set(self, v): self.{address} = v',
+    ])
+    return _Address(path, functions['get'], functions['set'])
+
+
+class _Address:
+    """The path to a leaf field, and functions to get and set it"""
+
+    __slots__ = 'path', 'get', 'set'
+
+    def __init__(self, path, get, set):
+        self.path, self.get, self.set = path, get, set
+
+
+def _compile(lines):
+    namespace = {'Configs': Configs}
+    exec('\n'.join(lines), namespace)
+    return namespace
 
 
 def _string_value(name, v, original_value):
-    if original_value is None or isinstance(v, str):
+    if original_value is None or isinstance(original_value, str):
         return v
 
-    if isinstance(original_value, int):
-        return int(v)
-
-    if isinstance(original_value, float):
-        return float(v)
+    if isinstance(original_value, enum.Enum):
+        return type(original_value)[v]
 
     if isinstance(original_value, bool):
         if v.lower() in ('t', 'true'):
@@ -103,33 +607,358 @@ def _string_value(name, v, original_value):
             return False
         raise ValueError(f'Cannot understand bool {name}={v}')
 
-    if isinstance(original_value, Enum):
-        return type(original_value)[v]
+    if isinstance(original_value, int):
+        return int(v)
+
+    if isinstance(original_value, float):
+        return float(v)
 
     return json.loads(v)
 
 
+_SNAPSHOT_VERSION = 1
+_SNAPSHOT_MAGIC = 'cfgs-snapshot'
+
+
+def _snapshot_dumps(schema, payload):
+    import marshal
+
+    data = _SNAPSHOT_MAGIC, _SNAPSHOT_VERSION, schema, payload
+    try:
+        return marshal.dumps(data, 4)
+    except ValueError:
+        raise ValueError('Only plain data can be in a snapshot') from None
+
+
+def _snapshot_loads(data, schema):
+    import marshal
+
+    try:
+        magic, version, found, payload = marshal.loads(data)
+    except (EOFError, TypeError, ValueError):
+        magic = version = None
+
+    if magic != _SNAPSHOT_MAGIC or version != _SNAPSHOT_VERSION:
+        raise ValueError('Not a cfgs snapshot, or an unknown version')
+    if schema is None and found is not None:
+        raise ValueError('Load Configs snapshots with cfgs.Configs.load')
+    if found != schema:
+        msg = 'Snapshot schema is stale: %s != %s'
+        raise ValueError(msg % (found, schema))
+    return payload
+
+
+def set_parse_cache(directory=None):
+    """
+    Keep the parsed contents of config files read by `cfgs.Configs.load` in
+    a `cfgs.CacheDirectory`, so that other processes can skip parsing files
+    that have not changed.  If `directory` is None, stop using the cache.
+
+    Parsed files are always cached in memory, whether or not there is
+    a cache directory.
+    """
+    global _PARSE_DIRECTORY
+    _PARSE_DIRECTORY = directory
+
+
+_PARSE_DIRECTORY = None
+_PARSED = {}
+
+
 def _load(p):
-    if p.suffix == '.json':
-        return json.loads(p.read_text())
+    """
+    Return the parsed contents of a config file, from the parse cache if the
+    file's inode, size and modification time have not changed
+    """
+    import pickle
+
+    s = os.stat(p)
+    stamp = s.st_ino, s.st_size, s.st_mtime_ns
+    path = os.path.abspath(p)
+
+    cached = _PARSED.get(path)
+    if cached and cached[0] == stamp:
+        return pickle.loads(cached[1])
+
+    data = None
+    if _PARSE_DIRECTORY:
+        key = json.dumps([path, stamp]).encode()
+        key = hashlib.sha256(key).hexdigest()
+        with _PARSE_DIRECTORY.open(key, binary=True) as fp:
+            if isinstance(fp, _CacheFile):
+                data = pickle.dumps(_parse(p), pickle.HIGHEST_PROTOCOL)
+                fp.write(data)
+            else:
+                data = fp.read()
+
+    try:
+        contents = pickle.loads(data)
+    except Exception:
+        # No cache directory, or a partial entry from a crashed process
+        data = pickle.dumps(_parse(p), pickle.HIGHEST_PROTOCOL)
+        contents = pickle.loads(data)
+
+    _PARSED[path] = stamp, data
+    return contents
+
+
+def _parse(p):
+    suffix = os.path.splitext(p)[1]
+    format = SUFFIX_TO_FORMAT.get(suffix)
+    if format == 'snapshot':
+        with open(p, 'rb') as fp:
+            return _snapshot_loads(fp.read(), None)
+
+    if format not in PARSER_BACKENDS:
+        raise ValueError('Do not understand suffix=' + suffix)
+
+    metrics = _metrics
+    with open(p) as fp:
+        text = fp.read()
+
+    start = metrics and time.perf_counter()
+    contents = parser_backend(format).loads(text)
+    if metrics:
+        elapsed = time.perf_counter() - start
+        metrics.observe('cfgs_format_read_seconds', elapsed, format=format)
+    return contents
+
+
+class Layer:
+    """
+    One layer of a `cfgs.Layers`, which returns a dict of values to load
+    into a `cfgs.Configs`.  Subclasses override `stale` and `read`.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        """The name of the layer, which `cfgs.Layers.source` reports"""
+
+    def stale(self):
+        """Return True if `read` might return something new"""
+        return False
+
+    def read(self, base):
+        """Return a dict of values, given the `cfgs.Configs` defaults"""
+        return {}
+
+
+class FileLayer(Layer):
+    """A config file, which is re-read only if its stat changes"""
+
+    def __init__(self, filename, name=None):
+        super().__init__(name or str(filename))
+        self.filename = os.fspath(filename)
+        """The path to the config file, which need not exist"""
+
+        self._stamp = _NONE
+
+    def stale(self):
+        return _stamp_of(self.filename) != self._stamp
+
+    def read(self, base):
+        self._stamp = _stamp_of(self.filename)
+        return _load(self.filename) if self._stamp else {}
+
+
+class EnvironLayer(Layer):
+    """Environment variables, read like `cfgs.Configs.load_from_environ`"""
+
+    def __init__(self, prefix, environ=None, name='environ'):
+        super().__init__(name)
+        self.prefix = prefix.strip('_').upper() + '_'
+        """Only variables starting with this prefix are read"""
+
+        self.environ = os.environ if environ is None else environ
+        """The environment, which defaults to `os.environ`"""
+
+        self._items = None
+
+    def stale(self):
+        return self._select() != self._items
+
+    def read(self, base):
+        self._items = self._select()
+        addresses = _plan(type(base)).environ
+        result = {}
+        for k, v in self._items.items():
+            address = addresses.get(k[len(self.prefix):].lower())
+            if address:
+                d = result
+                for p in address.path[:-1]:
+                    d = d.setdefault(p, {})
+                d[address.path[-1]] = _string_value(k, v, address.get(base))
+        return result
+
+    def _select(self):
+        pre = self.prefix
+        return {k: v for k, v in self.environ.items() if k.startswith(pre)}
+
+
+class OverrideLayer(Layer):
+    """Values set at runtime with `cfgs.Layers.set`"""
+
+    def __init__(self, name='override'):
+        super().__init__(name)
+        self.values = {}
+        """A dict of values"""
+
+    def read(self, base):
+        return self.values
+
+
+class Layers:
+    """
+    A stack of `cfgs.Layer`s of configuration, where each layer overrides
+    the ones before it, merged lazily into one view on top of the defaults
+    in a `cfgs.Configs`.
+
+    Each layer is flattened into a dict from field address to value, and the
+    merge of every prefix of the stack is kept, so when a layer changes, only
+    it and the merges after it are recomputed.  Lookups with `get` and
+    `source` use the cached merge, and never touch the filesystem: call
+    `refresh` to check the layers for changes.
+    """
+
+    def __init__(self, configs: Configs, *layers: Layer):
+        """
+        Arguments:
+          configs: A `cfgs.Configs` holding the default values.  It is not
+              changed
+
+          layers: The layers, from lowest to highest priority.  If the last
+              layer is not an `OverrideLayer`, one is added
+        """
+        self.base = copy.deepcopy(configs)
+        """A copy of the defaults"""
+
+        self.layers = list(layers)
+        """The `cfgs.Layer`s, lowest priority first"""
+
+        if not (layers and isinstance(layers[-1], OverrideLayer)):
+            self.layers.append(OverrideLayer())
+
+        self._flat = [None] * len(self.layers)
+        self._merged = [None] * len(self.layers)
+        self._configs = None
+
+    @property
+    def configs(self):
+        """A `cfgs.Configs` with all the layers applied, built on demand"""
+        self._merge()
+        if self._configs is None:
+            configs = copy.deepcopy(self.base)
+            for path, (value, _) in self._merged[-1].items():
+                d = {path[-1]: value}
+                for p in reversed(path[:-1]):
+                    d = {p: d}
+                configs.copy_from(**d)
+            self._configs = configs
+        return self._configs
+
+    def get(self, address, default=_NONE):
+        """
+        Return the value of a leaf field from the merged view.
+
+        Arguments:
+          address: a dotted name like `'midi.channel'`, or a tuple of names
+
+          default: returned if no layer sets the field.  If not given, the
+              value from the defaults is returned
+        """
+        path = _path(address)
+        try:
+            return self._merge()[path][0]
+        except KeyError:
+            if default is not _NONE:
+                return default
+            return functools.reduce(getattr, path, self.base)
+
+    def source(self, address):
+        """Return the name of the layer that set a field, or None"""
+        item = self._merge().get(_path(address))
+        return item and item[1]
+
+    def set(self, address, value):
+        """Set a value in the last `cfgs.OverrideLayer`"""
+        path = _path(address)
+        d = self.layers[-1].values
+        for p in path[:-1]:
+            d = d.setdefault(p, {})
+        d[path[-1]] = value
+
+        if self._flat[-1] is not None:
+            self._flat[-1][path] = value
+            if self._merged[-1] is not None:
+                self._merged[-1][path] = value, self.layers[-1].name
+                self._configs = None
+
+    def refresh(self):
+        """
+        Re-read any layers that have changed, and return True if the merged
+        view changed
+        """
+        first = None
+        for i, layer in enumerate(self.layers):
+            if self._flat[i] is None or layer.stale():
+                flat = dict(_flatten(type(self.base), layer.read(self.base)))
+                if flat != self._flat[i]:
+                    self._flat[i] = flat
+                    first = i if first is None else first
+
+        if first is None:
+            return False
 
-    if p.suffix == '.toml':
+        previous = self._merged[first - 1] if first else {}
+        for i in range(first, len(self.layers)):
+            name = self.layers[i].name
+            merged = dict(previous)
+            merged.update((k, (v, name)) for k, v in self._flat[i].items())
+            self._merged[i] = previous = merged
+
+        self._configs = None
+        return True
+
+    def _merge(self):
+        if self._merged[-1] is None:
+            self.refresh()
+        return self._merged[-1]
+
+
+def _path(address):
+    return tuple(address.split('.')) if isinstance(address, str) else address
+
+
+def _flatten(cls, d, prefix=()):
+    kinds = _plan(cls).kinds
+    for k, v in d.items():
         try:
-            import tomllib
-            return tomllib.loads(p.read_text())
-        except ImportError:
-            import tomlkit
-            return tomlkit.loads(p.read_text())
+            kind = kinds[k]
+        except KeyError:
+            raise AttributeError(k) from None
+        if isinstance(kind, type) and isinstance(v, dict):
+            yield from _flatten(kind, v, prefix + (k,))
+        else:
+            yield prefix + (k,), v
 
-    if p.suffix == '.yaml':
-        import yaml
-        return yaml.safe_load(p.read_text())
 
-    raise ValueError('Do not understand suffix=' + p.suffix)
+def _stamp_of(filename):
+    try:
+        s = os.stat(filename)
+    except FileNotFoundError:
+        return None
+    return s.st_ino, s.st_size, s.st_mtime_ns
 
 
 _getenv = os.environ.get
-_expandvars = os.path.expandvars
+
+
+def _expandvars(s):
+    # os.path.expandvars imports re, which is slow, so expand $HOME directly
+    home = _getenv('HOME')
+    if home and s.startswith('$HOME') and '$' not in s[5:]:
+        return home + s[5:]
+    return os.path.expandvars(s)
 
 
 class App:
@@ -142,7 +971,12 @@ class App:
     """The default, default file format for all Apps"""
 
     def __init__(
-        self, name, format=DEFAULT_FORMAT, read_kwds=None, write_kwds=None
+        self,
+        name,
+        format=DEFAULT_FORMAT,
+        read_kwds=None,
+        write_kwds=None,
+        sync=None,
     ):
         """
         Arguments:
@@ -152,13 +986,10 @@ class App:
                 pathnames
 
           format: the format for config and data files from this App
-        """
 
-        def path(attrname):
-            path = getattr(self.xdg, attrname)
-            if attrname.endswith('DIRS'):
-                return [os.path.join(i, self.name) for i in path.split(':')]
-            return os.path.join(path, self.name)
+          sync: how durable writes to config and data files are:
+                see `cfgs.File.sync`
+        """
 
         _check_filename(name)
 
@@ -168,25 +999,50 @@ class App:
         self.xdg = XDG()
         """A `cfg.XFG` as of when the App was constructed."""
 
-        self.cache = Cache(path('XDG_CACHE_HOME'))
-        """A `cfg.Cache` that manages cache directories"""
-
         if format not in FORMATS:
             raise ValueError('Unknown format', format)
 
         if format == 'configparser':
             self.format = ConfigparserFormat()
             """A `cfgs.Format` representing the data format."""
+        elif format == 'snapshot':
+            self.format = SnapshotFormat()
+        elif format == 'jsonl':
+            self.format = JsonLinesFormat()
         else:
             self.format = Format(format, read_kwds, write_kwds)
 
-        h, d = path('XDG_CONFIG_HOME'), path('XDG_CONFIG_DIRS')
-        self.config = Directory(h, d, self.format)
+        self._sync = sync
+        self._cache = self._config = self._data = None
+
+    @property
+    def cache(self):
+        """A `cfg.Cache` that manages cache directories"""
+        if self._cache is None:
+            self._cache = Cache(self._path('XDG_CACHE_HOME'))
+        return self._cache
+
+    @property
+    def config(self):
         """A `cfgs.Directory` for config files"""
+        if self._config is None:
+            h, d = self._path('XDG_CONFIG_HOME'), self._path('XDG_CONFIG_DIRS')
+            self._config = Directory(h, d, self.format, self._sync)
+        return self._config
 
-        h, d = path('XDG_DATA_HOME'), path('XDG_DATA_DIRS')
-        self.data = Directory(h, d, self.format)
+    @property
+    def data(self):
         """A `cfgs.Directory` for data files"""
+        if self._data is None:
+            h, d = self._path('XDG_DATA_HOME'), self._path('XDG_DATA_DIRS')
+            self._data = Directory(h, d, self.format, self._sync)
+        return self._data
+
+    def _path(self, attrname):
+        path = getattr(self.xdg, attrname)
+        if attrname.endswith('DIRS'):
+            return [os.path.join(i, self.name) for i in path.split(':')]
+        return os.path.join(path, self.name)
 
 
 class XDG:
@@ -243,7 +1099,14 @@ class Directory:
     An XDG directory of persistent, formatted files
     """
 
-    def __init__(self, home, dirs, format):
+    INDEX_INTERVAL = 1.0
+    """
+    How many seconds `all_files` trusts a cached directory listing before
+    checking the directory's mtime again.  Files written through `cfgs.File`
+    are seen at once: other changes may take this long to be seen
+    """
+
+    def __init__(self, home, dirs, format, sync=None):
         """
         Don't call this constructor directly - use either
         `cfgs.App.config` or `cfgs.App.data` instead.
@@ -252,9 +1115,10 @@ class Directory:
         self.dirs = dirs
         assert not isinstance(format, str)
         self.format = format
+        self.sync = sync
         self.dirs.insert(0, self.home)
 
-    def open(self, filename=None):
+    def open(self, filename=None, journal=False, lazy=False):
         """
         Open a persistent `cfg.File`.
 
@@ -262,178 +1126,1663 @@ class Directory:
           filename: The name of the persistent file. If None,
             `filename` defaults to `cfg.App.name` plus the format suffix
 
+          journal: If True, only changes are written, to a journal which is
+            merged into the file in the background: see `cfgs.File.journal`
+
+          lazy: If True, the file is only read when its contents are first
+            used, and `cfgs.File.get` can read single keys without reading
+            the whole file
+
           format: A string representing the file format.  If None,
              first try to guess the filename from the filename, then use
              `self.format`
         """
-        if not filename:
-            basename = os.path.basename(self.home)
-            suffix = FORMAT_TO_SUFFIX[self.format.name]
-            filename = '%s%s' % (basename, suffix)
-        elif filename.startswith('/'):
-            filename = filename[1:]
+        full = self._full_name(filename)
+        return File(full, self.format, journal, self.sync, lazy=lazy)
 
-        return File(self.full_name(filename), self.format)
-
-    def all_files(self, filename):
+    def aopen(self, filename=None):
         """
-        Yield all filenames matching the argument in either the home
-        directory or any of the search directories
+        Like `cfgs.Directory.open`, but return an `asyncio.Future` for the
+        `cfgs.File`, which is read on a worker thread
         """
-        for p in self.dirs:
-            full_path = os.path.join(p, filename)
-            try:
-                yield open(full_path) and full_path
-            except IOError:
-                pass
+        return _run_async(self.open, filename)
 
-    def full_name(self, filename):
+    def stream(self, filename=None):
         """
-        Return the full name of a file with respect to this XDG directory
+        Yield the top-level items of a file one at a time, without reading
+        the whole file into memory, as described in `cfgs.Format.stream`.
+        A missing file yields nothing.  Journals are not read.
         """
-        return os.path.join(self.home, filename)
-
+        full = self._full_name(filename)
+        try:
+            fp = open(full, 'rb' if self.format.binary else 'r')
+        except FileNotFoundError:
+            return
 
-class File:
-    """
-    A formatted data or config file where you can set and get items,
-    and read or write.
-    """
+        with fp:
+            yield from self.format.stream(fp)
 
-    def __init__(self, filename, format):
+    def open_many(
+        self, filenames, journal=False, threads=None, processes=None
+    ):
+        """
+        Open many `cfgs.File`s at once, reading them on a pool of threads,
+        and yield each one as soon as it is ready, in order of completion.
+
+        Arguments:
+          filenames: The names of the files, as for `cfgs.Directory.open`
+
+          journal: If True, open the files in journal mode
+
+          threads: The number of threads for file I/O, which defaults to
+              `cfgs.ASYNC_WORKERS`
+
+          processes: If not None, parse the files in a pool of processes,
+              which helps with slow formats like YAML and TOML.  Either the
+              number of processes, or a `concurrent.futures.Executor`
+        """
+        binary = self.format.binary
+
+        def open_one(filename, pool):
+            if not pool:
+                return self.open(filename, journal)
+
+            full = self._full_name(filename)
+            try:
+                with open(full, 'rb' if binary else 'r') as fp:
+                    data = fp.read()
+            except IOError:
+                data = None
+
+            contents = pool.submit(_parse_data, self.format, data).result()
+            return File(full, self.format, journal, self.sync, contents)
+
+        with _Pools(threads, processes) as (thread_pool, pool):
+            futures = [
+                thread_pool.submit(open_one, f, pool) for f in filenames
+            ]
+            for future in _as_completed(futures):
+                yield future.result()
+
+    def write_many(self, files, threads=None, processes=None):
+        """
+        Write many `cfgs.File`s at once, on a pool of threads, and return
+        when they have all been written.
+
+        Arguments:
+          files: The `cfgs.File`s to write
+
+          threads: The number of threads for file I/O, which defaults to
+              `cfgs.ASYNC_WORKERS`
+
+          processes: If not None, serialize the contents in a pool of
+              processes: either the number of processes, or a
+              `concurrent.futures.Executor`
+        """
+        def write_one(file, pool):
+            if not pool or file.journal:
+                return file.write()
+
+            data = pool.submit(_dump_data, file.format, file.contents)
+            file._write_dumped(data.result())
+
+        with _Pools(threads, processes) as (thread_pool, pool):
+            futures = [thread_pool.submit(write_one, f, pool) for f in files]
+            for future in _as_completed(futures):
+                future.result()
+
+    def layers(self, configs, filename, prefix=None, files=(), environ=None):
+        """
+        Return a `cfgs.Layers` that loads `configs` from `filename` in each
+        of the system directories, then the home directory, then from
+        `files`, then from environment variables starting with `prefix`, if
+        it is not None, and lastly from values set at runtime.
+
+        Arguments:
+          configs: A `cfgs.Configs` with the default values
+          filename: The name of the config file in each directory
+          prefix: The prefix for environment variables, or None
+          files: More config files, loaded in order after the directories
+          environ: The environment, which defaults to `os.environ`
+        """
+        dirs = reversed(self.dirs)
+        layers = [FileLayer(os.path.join(d, filename)) for d in dirs]
+        layers.extend(FileLayer(f) for f in files)
+        if prefix is not None:
+            layers.append(EnvironLayer(prefix, environ))
+        return Layers(configs, *layers)
+
+    def all_files(self, filename):
+        """
+        Yield all filenames matching the argument in either the home
+        directory or any of the search directories.
+
+        Directory listings are cached, and each one is only checked against
+        its directory's mtime once every `cfgs.Directory.INDEX_INTERVAL`
+        seconds, so most lookups need no system calls at all.
+        """
+        for p in self.dirs:
+            full_path = os.path.join(p, filename)
+            dirname, name = os.path.split(full_path)
+            if name in _listing(dirname, self.INDEX_INTERVAL):
+                yield full_path
+
+    def aall_files(self, filename):
+        """
+        Return an `asyncio.Future` for a list of the results of
+        `cfgs.Directory.all_files`, which are found on a worker thread
+        """
+        return _run_async(lambda: list(self.all_files(filename)))
+
+    def full_name(self, filename):
+        """
+        Return the full name of a file with respect to this XDG directory
+        """
+        return os.path.join(self.home, filename)
+
+    def _full_name(self, filename):
+        if not filename:
+            basename = os.path.basename(self.home)
+            suffix = FORMAT_TO_SUFFIX[self.format.name]
+            filename = '%s%s' % (basename, suffix)
+        elif filename.startswith('/'):
+            filename = filename[1:]
+        return self.full_name(filename)
+
+
+class _Pools:
+    """A pool of threads and an optional pool of processes, for a batch"""
+
+    def __init__(self, threads, processes):
+        self._threads = threads or ASYNC_WORKERS
+        self._processes = processes
+        self._own = None
+
+    def __enter__(self):
+        from concurrent import futures
+
+        self._thread_pool = futures.ThreadPoolExecutor(self._threads, 'cfgs')
+        processes = self._processes
+        if isinstance(processes, int):
+            processes = self._own = futures.ProcessPoolExecutor(processes)
+        return self._thread_pool, processes
+
+    def __exit__(self, *args):
+        self._thread_pool.shutdown(cancel_futures=True)
+        if self._own:
+            self._own.shutdown(cancel_futures=True)
+
+
+def _as_completed(futures):
+    from concurrent.futures import as_completed
+
+    return as_completed(futures)
+
+
+def _parse_data(format, data):
+    """Parse the text or bytes of a file in a worker process"""
+    if data is None:
+        return format.create()
+    import io
+
+    fp = io.BytesIO(data) if format.binary else io.StringIO(data)
+    return format.read(fp)
+
+
+def _dump_data(format, contents):
+    """Serialize contents to text or bytes in a worker process"""
+    import io
+
+    fp = io.BytesIO() if format.binary else io.StringIO()
+    format.write(contents, fp)
+    return fp.getvalue()
+
+
+class _Dumped:
+    """Write contents which were already serialized by `_dump_data`"""
+
+    def __init__(self, binary):
+        self.binary = binary
+
+    def write(self, data, fp):
+        fp.write(data)
+
+
+_LISTINGS = {}
+_RACY_NS = 2_000_000_000
+
+
+def _listing(dirname, interval):
+    """
+    Return the names of the non-directories in a directory, or an empty set
+    if it does not exist, from a cache which is checked against the
+    directory's inode and mtime at most once every `interval` seconds
+    """
+    now = time.monotonic()
+    entry = _LISTINGS.get(dirname)
+    if entry and now - entry[0] < interval:
+        return entry[2]
+
+    try:
+        s = os.stat(dirname)
+    except OSError:
+        _LISTINGS[dirname] = now, None, frozenset()
+        return frozenset()
+
+    stamp = s.st_ino, s.st_mtime_ns
+    if entry and entry[1] == stamp:
+        names = entry[2]
+    else:
+        try:
+            with os.scandir(dirname) as it:
+                names = frozenset(e.name for e in it if not e.is_dir())
+        except OSError:
+            names = frozenset()
+
+        # A file added within the same clock tick would not change the mtime
+        if time.time_ns() - s.st_mtime_ns < _RACY_NS:
+            stamp = s.st_ino, None
+
+    _LISTINGS[dirname] = now, stamp, names
+    return names
+
+
+class File:
+    """
+    A formatted data or config file where you can set and get items,
+    and read or write.
+    """
+
+    COMPACT_BYTES = 0x100000
+    """In journal mode, compact when the journal is longer than this, and
+    longer than the file itself"""
+
+    def __init__(
+        self,
+        filename,
+        format,
+        journal=False,
+        sync=None,
+        contents=None,
+        lazy=False,
+    ):
         """Do not call this constructor directly but use
         `cfg.Directory.open` instead"""
 
-        self.filename = filename
-        """The full pathname to the data file"""
+        self.filename = filename
+        """The full pathname to the data file"""
+
+        self.journal = filename + '.journal' if journal else None
+        """
+        In journal mode, the name of the journal file, or else None.
+
+        In journal mode, `write` only appends the top-level keys which have
+        changed to the journal, which is merged back into the file in the
+        background when it gets too long.  All the values must be
+        serializable as JSON, and the format cannot be `configparser`.
+
+        Many `File`s, in many processes, can append to the same journal:
+        appends and compactions are serialized by a lock file next to it.
+        """
+
+        self.sync = sync
+        """
+        How durable writes are.  The file is always written to a temporary
+        file, which is atomically renamed over the file, so readers never see
+        a partial file.  Then:
+
+        * `None`: the data is not explicitly flushed to disk
+        * `'file'`: `os.fsync` is called on the data before the rename
+        * `'directory'`: the directory is also synced after the rename
+        * a `cfgs.GroupCommit`: writes from many threads are batched,
+          so they share their syncs
+        """
+
+        if not (sync in _SYNCS or isinstance(sync, GroupCommit)):
+            raise ValueError('Unknown sync', sync)
+
+        if journal and format.name in ('configparser', 'jsonl'):
+            raise ValueError(format.name + ' files cannot use a journal')
+
+        os.makedirs(os.path.dirname(self.filename), exist_ok=True)
+        self.format = format
+        self._contents = _NONE
+        self._snapshot = None
+        self._frozen = None
+        self._index = None
+        self._lock = threading.Lock()
+        self._compactor = None
+        self._journal_lock = journal and _journal_lock(self.journal)
+        if contents is not None:
+            self._loaded(contents)
+        elif not lazy:
+            self.read()
+
+    @property
+    def contents(self):
+        """The contents of the formatted file, read and parsed.
+
+        This will be a `dict` for all formats except `configparser`,
+        where it will be a `configparser.SafeConfigParser`.
+
+        If the file was opened with `lazy=True`, it is only read when the
+        contents are first used.
+        """
+        if self._contents is _NONE:
+            self.read()
+        return self._contents
+
+    @contents.setter
+    def contents(self, contents):
+        if self._contents is _NONE and self.journal:
+            self.read()  # The journal needs to know what changed
+        self._contents = contents
+
+    @property
+    def dirty(self):
+        """True if the contents have changed since they were read or written"""
+        if self._contents is _NONE:
+            return False
+        return not self.format.equal(self._contents, self._snapshot)
+
+    def get(self, key, default=None):
+        """
+        Return the value of one top-level key, or `default`.
+
+        If the contents have not been read yet, a JSON file is not parsed:
+        instead, the value is read from its offset in the file, from an
+        index kept in a hidden file next to it, which is rebuilt whenever
+        the file changes.
+        """
+        if self._contents is not _NONE or self.journal:
+            return self.contents.get(key, default)
+        if self.format.name != 'json':
+            return self.contents.get(key, default)
+
+        try:
+            fp = open(self.filename, 'rb')
+        except FileNotFoundError:
+            return default
+
+        with fp:
+            self._index = _KeyIndex.load(fp, self.filename, self._index)
+            return self._index.get(fp, key, default)
+
+    def read(self):
+        """Re-read the contents from the file"""
+        if not self.journal:
+            return self._loaded(self._read_file())
+
+        with self._journal_lock:
+            return self._loaded(self._read_file())
+
+    def _read_file(self):
+        metrics = _metrics
+        try:
+            mode = 'rb' if self.format.binary else 'r'
+            with open(self.filename, mode) as fp:
+                start = metrics and time.perf_counter()
+                contents = self.format.read(fp)
+                if metrics:
+                    metrics.observe(
+                        'cfgs_format_read_seconds',
+                        time.perf_counter() - start,
+                        format=self.format.name,
+                    )
+        except IOError:
+            contents = self.format.create()
+        return contents
+
+    def _loaded(self, contents):
+        self._contents = contents
+        if self.journal:
+            for journal in self.journal + '.old', self.journal:
+                _replay_journal(contents, journal)
+
+        self._snapshot = self.format.snapshot(contents)
+        return contents
+
+    def write(self):
+        """Write the contents to the file"""
+        if self.journal:
+            return self._write_journal()
+
+        _atomic_write(self.filename, self.sync, self.format, self.contents)
+        self._snapshot = self.format.snapshot(self.contents)
+
+    def _write_dumped(self, data):
+        # Write contents which were already serialized by `_dump_data`
+        if self.journal:
+            return self._write_journal()
+
+        format = _Dumped(self.format.binary)
+        _atomic_write(self.filename, self.sync, format, data)
+        self._snapshot = self.format.snapshot(self.contents)
+
+    def compact(self, wait=True):
+        """
+        In journal mode, write all the contents to the file and empty the
+        journal, on a background thread unless `wait` is true.  Otherwise,
+        do nothing
+        """
+        if not self.journal:
+            return
+
+        with self._lock:
+            if self._compactor:
+                self._compactor.join()
+
+            if wait:
+                self._compact()
+            else:
+                self._compactor = threading.Thread(target=self._compact)
+                self._compactor.start()
+
+    def _compact(self):
+        # Other Files might have appended to the same journal, so the file is
+        # rebuilt from what is on disk, and not from this File's contents
+        old = self.journal + '.old'
+        with self._journal_lock:
+            # If `old` exists, an earlier compaction was interrupted
+            if not os.path.exists(old):
+                try:
+                    os.replace(self.journal, old)
+                except FileNotFoundError:
+                    return
+
+            contents = self._read_file()
+            _replay_journal(contents, old)
+            _atomic_write(self.filename, self.sync, self.format, contents)
+            os.remove(old)
+
+    def aread(self):
+        """Return an `asyncio.Future` that re-reads the contents"""
+        return _run_async(self.read)
+
+    def awrite(self):
+        """Return an `asyncio.Future` that writes the contents"""
+        return _run_async(self.write)
+
+    def as_dict(self):
+        """Return a deep copy of the contents as a dict"""
+        return self.format.as_dict(self.contents)
+
+    def clear(self):
+        """Clear the contents without writing"""
+        self.contents.clear()
+
+    def freeze(self):
+        """
+        Return an immutable copy of the contents, from `cfgs.freeze_data`,
+        which shares every unchanged part with the copy returned last time
+        """
+        contents = self.contents
+        if not isinstance(contents, dict):
+            contents = self.as_dict()
+        self._frozen = freeze_data(contents, self._frozen)
+        return self._frozen
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        if self.dirty:
+            self.write()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        if self.dirty:
+            await self.awrite()
+
+    def _write_journal(self):
+        contents, snapshot = self.contents, self._snapshot
+        lines = [['-', k] for k in snapshot if k not in contents]
+        for k, v in contents.items():
+            if k not in snapshot or snapshot[k] != v:
+                lines.append(['+', k, v])
+        if not lines:
+            return
+
+        with self._lock, self._journal_lock:
+            with open(self.journal, 'a') as fp:
+                start = fp.tell()
+                for line in lines:
+                    fp.write(json.dumps(line) + '\n')
+                size = fp.tell()
+                if self.sync:
+                    fp.flush()
+                    os.fsync(fp.fileno())
+
+            metrics = _metrics
+            if metrics:
+                metrics.count('cfgs_journal_writes_total')
+                metrics.observe('cfgs_journal_write_bytes', size - start)
+
+            snapshot = dict(snapshot)
+            for line in lines:
+                if line[0] == '+':
+                    snapshot[line[1]] = self.format.snapshot(line[2])
+                else:
+                    del snapshot[line[1]]
+            self._snapshot = snapshot
+
+        try:
+            file_size = os.path.getsize(self.filename)
+        except OSError:
+            file_size = 0
+        if size > max(file_size, self.COMPACT_BYTES):
+            self.compact(wait=False)
+
+
+class GroupCommit:
+    """
+    Batch durable writes of `cfgs.File`s from many threads, so that all the
+    writes made within `window` seconds of each other share one round of
+    syncs.  A later write to a file in the same batch replaces the earlier
+    one, which is never synced at all.
+
+    Each `cfgs.File.write` still only returns when its data is on disk.
+    """
+
+    def __init__(self, window=0.005, directory=True):
+        self.window = window
+        """How long the first write in a batch waits for more writes"""
+
+        self.directory = directory
+        """If True, sync each directory after its files are renamed"""
+
+        self._lock = threading.Lock()
+        self._batch = None
+
+    def commit(self, tmp, filename):
+        """Sync `tmp` and rename it to `filename`, in the next batch"""
+        filename = os.path.realpath(filename)
+        with self._lock:
+            batch = self._batch
+            leader = batch is None
+            if leader:
+                batch = self._batch = _Batch()
+            superseded = batch.files.pop(filename, None)
+            batch.files[filename] = tmp
+
+        if superseded:
+            os.remove(superseded)
+
+        if leader:
+            time.sleep(self.window)
+            with self._lock:
+                self._batch = None
+            try:
+                batch.run(self.directory)
+            except Exception as e:
+                batch.error = e
+            batch.done.set()
+        else:
+            batch.done.wait()
+
+        if batch.error:
+            raise batch.error
+
+
+class _Batch:
+    def __init__(self):
+        self.files = {}
+        self.done = threading.Event()
+        self.error = None
+
+    def run(self, directory):
+        for tmp in self.files.values():
+            _fsync(tmp)
+        for filename, tmp in self.files.items():
+            os.replace(tmp, filename)
+        if directory:
+            for d in {os.path.dirname(f) for f in self.files}:
+                _fsync(d)
+
+
+_SYNCS = None, 'file', 'directory'
+
+
+def _atomic_write(filename, sync, format, contents):
+    """Atomically replace a file with `format.write(contents, fp)`"""
+    # Write through a symbolic link rather than replacing it
+    link_dir, filename = os.path.dirname(filename), os.path.realpath(filename)
+    ids = filename, os.getpid(), threading.get_ident()
+    tmp = '%s.%d.%d.tmp' % ids
+    metrics = _metrics
+    start = metrics and time.perf_counter()
+    try:
+        with open(tmp, 'wb' if format.binary else 'w') as fp:
+            format.write(contents, fp)
+            size = fp.tell()
+            if sync and not isinstance(sync, GroupCommit):
+                fp.flush()
+                os.fsync(fp.fileno())
+        try:
+            os.chmod(tmp, os.stat(filename).st_mode & 0o7777)
+        except FileNotFoundError:
+            pass
+
+        if isinstance(sync, GroupCommit):
+            sync.commit(tmp, filename)
+        else:
+            os.replace(tmp, filename)
+            if sync == 'directory':
+                _fsync(os.path.dirname(filename))
+        _LISTINGS.pop(os.path.dirname(filename), None)
+        _LISTINGS.pop(link_dir, None)
+
+        if metrics:
+            elapsed = time.perf_counter() - start
+            metrics.count('cfgs_file_writes_total')
+            metrics.observe('cfgs_file_write_bytes', size)
+            metrics.observe('cfgs_file_write_seconds', elapsed)
+
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+
+def _fsync(filename):
+    fd = os.open(filename, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _journal_lock(journal):
+    # Many Files, in many processes, can append to the same journal
+    if os.name == 'posix':
+        return _FileLock(journal + '.lock')
+    return _JOURNAL_LOCKS.setdefault(journal, threading.RLock())
+
+
+_JOURNAL_LOCKS = {}
+
+
+def _replay_journal(contents, journal):
+    try:
+        fp = open(journal)
+    except FileNotFoundError:
+        return
+
+    with fp:
+        for line in fp:
+            try:
+                op, key, *value = json.loads(line)
+            except ValueError:
+                # The last line of a crashed write
+                break
+            if op == '+':
+                contents[key] = value[0]
+            else:
+                contents.pop(key, None)
+
+
+class Cache:
+    """
+    A class that creates caches
+    """
+
+    DEFAULT_POLICY = 'mtime'
+    """The default eviction policy for all cache directories"""
+
+    def __init__(self, dirname):
+        """Do not call this constructor - instead use `cfgs.App.cache` """
+
+        self.dirname = dirname
+        """The full path of the root directory for all cache directories"""
+
+    def directory(
+        self,
+        name='cache',
+        cache_size=0,
+        policy=DEFAULT_POLICY,
+        atomic=False,
+        shards=0,
+        codec=None,
+    ):
+        """
+        Return a `cfgs.CacheDirectory`
+
+        Arguments:
+          name: The relative pathname of the cache directory
+
+          cache_size: The number of bytes allowed in the cache.
+              The default of 0 means "unlimited cache size"
+
+          policy: Which entries to evict first: either a name from
+              `cfgs.CACHE_POLICIES` or a `cfgs.CachePolicy` instance
+
+          atomic: If True, the cache directory is safe to share between
+              processes: see `cfgs.CacheDirectory.atomic`
+
+          shards: The number of levels of subdirectories to spread the
+              cached files over: see `cfgs.CacheDirectory.shards`
+
+          codec: If not None, compress the cached files with either a name
+              from `cfgs.CACHE_CODECS` or a `cfgs.CacheCodec` instance
+        """
+        name = os.path.join(self.dirname, name)
+        return CacheDirectory(name, cache_size, policy, atomic, shards, codec)
+
+    def memoize(
+        self, name=None, cache_size=0, serializer=None, maxsize=128, **kwargs
+    ):
+        """
+        Return a decorator that memoizes a function in a cache directory,
+        with an in-process LRU cache in front of it.
+
+        The arguments to each call are pickled and hashed to give the
+        filename of its result, so they must be picklable and must pickle
+        the same way every time.
+
+        Arguments:
+          name: The relative pathname of the cache directory.  If None, the
+              module and qualified name of the function are used
+
+          cache_size: The number of bytes allowed in the cache directory
+
+          serializer: Something like `pickle` or `marshal`, with `dump()`
+              and `load()` functions that work on binary files.  If None,
+              `pickle` is used
+
+          maxsize: The number of results kept in memory, or 0 for none
+
+          kwargs: Passed to `cfgs.Cache.directory`: the default here is
+              `atomic=True`
+        """
+        kwargs.setdefault('atomic', True)
+
+        def directory(func):
+            n = name or '%s.%s' % (func.__module__, func.__qualname__)
+            return self.directory(n, cache_size, **kwargs)
+
+        def decorator(func):
+            return _Memoized(func, directory, serializer, maxsize)
+
+        return decorator
+
+
+class _Memoized:
+    """A function memoized by `cfgs.Cache.memoize`"""
+
+    def __init__(self, func, directory, serializer, maxsize):
+        functools.update_wrapper(self, func)
+        self.func = func
+        self.maxsize = maxsize
+        self.memory = collections.OrderedDict()
+        self._serializer = serializer
+        self._make_directory = directory
+        self._directory = None
+        self._lock = threading.Lock()
+
+    @property
+    def directory(self):
+        """The `cfgs.CacheDirectory` holding the results, created on demand"""
+        if self._directory is None:
+            self._directory = self._make_directory(self.func)
+        return self._directory
+
+    def __call__(self, *args, **kwargs):
+        import pickle
+
+        key = self.key(*args, **kwargs)
+        with self._lock:
+            if key in self.memory:
+                self.memory.move_to_end(key)
+                return self.memory[key]
+
+        serializer = self._serializer or pickle
+        with self.directory.open(key, binary=True) as fp:
+            if isinstance(fp, _CacheFile):
+                result = self.func(*args, **kwargs)
+                serializer.dump(result, fp)
+            else:
+                result = serializer.load(fp)
+
+        if self.maxsize:
+            with self._lock:
+                self.memory[key] = result
+                while len(self.memory) > self.maxsize:
+                    self.memory.popitem(last=False)
+        return result
+
+    def key(self, *args, **kwargs):
+        """Return the cache filename for the results of a call"""
+        import pickle
+
+        call = args, sorted(kwargs.items())
+        return hashlib.sha256(pickle.dumps(call, protocol=4)).hexdigest()
+
+    def cache_clear(self):
+        """Clear the in-process cache, but not the cache directory"""
+        with self._lock:
+            self.memory.clear()
+
+
+class CacheDirectory:
+    def __init__(
+        self,
+        dirname,
+        cache_size,
+        policy=Cache.DEFAULT_POLICY,
+        atomic=False,
+        shards=0,
+        codec=None,
+    ):
+        """Do not call this constructor - use `cfgs.Cache.directory`"""
+
+        self.dirname = dirname
+        """The full path to this cache directory"""
+
+        self.cache_size = cache_size
+        """
+        The number of bytes allowed in the cache.
+        0 means "unlimited cache size"
+        """
+
+        if isinstance(policy, str):
+            try:
+                policy = CACHE_POLICIES[policy]()
+            except KeyError:
+                raise ValueError('Unknown policy', policy) from None
+
+        self.policy = policy
+        """The `cfgs.CachePolicy` that decides which entries to evict"""
+
+        if isinstance(codec, str):
+            try:
+                codec = CACHE_CODECS[codec]
+            except KeyError:
+                raise ValueError('Unknown codec', codec) from None
+
+        self.codec = codec
+        """
+        A `cfgs.CacheCodec` that compresses the cached files, or None.
+
+        `cfgs.CacheDirectory.cache_size` counts the compressed size of files.
+        """
+
+        self.atomic = atomic
+        """
+        If True, new files are written to a temporary file which is renamed
+        into place when it is closed, so readers never see a partial file.
+
+        Only one process at a time can fill each file: the others wait
+        in `cfgs.CacheDirectory.open` until it is published, and then read it.
+        Pruning and updates to the index are serialized by a directory lock,
+        and the cache is pruned again as each new file is published.
+        """
+
+        self.shards = shards
+        """
+        The number of levels of subdirectories that the files are spread
+        over, each with up to 256 entries, chosen by a hash of the filename.
+
+        This keeps directories small when there are very many cached files.
+        0 means that all the files are directly in `dirname`.
+
+        Only changes to `dirname` itself make the index stale, so files
+        added to or removed from the shards by other programs will not be
+        noticed until the journal is rebuilt.
+        """
+
+        head, tail = os.path.split(self.dirname.rstrip('/'))
+        self.workdir = os.path.join(head, '.%s.work' % tail)
+        """The directory for temporary files and locks in atomic mode"""
+
+        self._name = tail
+
+        _makedirs(self.dirname)
+        if self.atomic:
+            _makedirs(self.workdir)
+
+        self.index = _CacheIndex(self.dirname, self.policy)
+        """A `cfgs._CacheIndex` of the sizes and ages of the cached files"""
+
+        if self.atomic:
+            self._lock = self._file_lock('.directory')
+        else:
+            self._lock = threading.RLock()
+        self.prune()
+
+    def open(self, filename, size_guess=0, binary=False):
+        """
+        Open a cached file in this directory.
+
+        If the file already exists, it is opened for read.
+
+        Otherwise the cache is pruned and the file is opened for write.
+
+        Arguments:
+          filename: the name of the file, relative to the cache directory
+          size_guess: A guess as to how large the file will be, in bytes
+          binary: if True, the file is opened in binary mode
+
+        """
+        if '/' in filename:
+            raise ValueError('Subdirectories are not allowed in caches')
+
+        bin = 'b' if binary else ''
+        metrics = _metrics
+
+        fp = self._open_hit(filename, bin)
+        if fp:
+            if metrics:
+                metrics.count('cfgs_cache_hits_total', cache=self._name)
+            return fp
+
+        key_lock = self._file_lock(filename + '.lock', remove=True)
+        key_lock.acquire()
+        try:
+            # Another process might have filled this while we waited
+            fp = self._open_hit(filename, bin)
+            if fp:
+                key_lock.release()
+                if metrics:
+                    metrics.count('cfgs_cache_hits_total', cache=self._name)
+                return fp
+
+            if metrics:
+                metrics.count('cfgs_cache_misses_total', cache=self._name)
+
+            full, tmp = self.full_name(filename), None
+            with self._lock:
+                self.index.sync()
+                if self.shards and not os.path.isdir(os.path.dirname(full)):
+                    os.makedirs(os.path.dirname(full), exist_ok=True)
+                    self.index.touch()
+                self.prune(size_guess)
+                if self.atomic:
+                    ids = filename, os.getpid(), threading.get_ident()
+                    tmp = os.path.join(self.workdir, '%s.%d.%d.tmp' % ids)
+                fp = self._open_file(tmp or full, 'w' + bin)
+                self.index.add(filename, size_guess)
+
+            return _CacheFile(self, fp, filename, tmp, key_lock)
+
+        except BaseException:
+            key_lock.release()
+            raise
+
+    def aopen(self, filename, size_guess=0, binary=False):
+        """
+        Like `cfgs.CacheDirectory.open`, but the file is opened on a worker
+        thread and its methods return `asyncio.Future`s.
+
+        Use either `fp = await cache.aopen(...)`
+        or `async with cache.aopen(...) as fp:`
+        """
+        return _AsyncOpen(self.open, filename, size_guess, binary)
+
+    def aprune(self, bytes_needed=0):
+        """
+        Start pruning the cache on a worker thread, and return an
+        `asyncio.Future` which can be awaited, or ignored
+        """
+        return _run_async(self.prune, bytes_needed)
+
+    def map(self, filename):
+        """
+        Return a read-only `mmap.mmap` of a file that is already in the cache.
+
+        The pages of the file are shared with every other process that maps
+        or reads it, and nothing is copied into Python memory until it is
+        sliced.  The map remains valid even if the file is later evicted.
+
+        Raises `FileNotFoundError` if the file is not in the cache.
+
+        Arguments:
+          filename: the name of the file, relative to the cache directory
+        """
+        import mmap
+
+        if '/' in filename:
+            raise ValueError('Subdirectories are not allowed in caches')
+        if self.codec:
+            raise ValueError('Compressed caches cannot be mapped')
+
+        fp = self._open_hit(filename, 'b')
+        if not fp:
+            raise FileNotFoundError(self.full_name(filename))
+
+        with fp:
+            if not os.fstat(fp.fileno()).st_size:
+                # Empty files cannot be mapped
+                return memoryview(b'')
+            return mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def prune(self, bytes_needed=0):
+        """
+        Prune the cache to generate at least `bytes_needed` of free space,
+        if this is possible.
+
+        Entries which have expired under the policy are always removed,
+        even if the cache has no size limit.
+        """
+        if not (self.cache_size or self.policy.expires):
+            return
+
+        index = self.index
+
+        def full():
+            if not index.entries:
+                return False
+            if index.expired():
+                return True
+            size = self.cache_size
+            return size and index.total + bytes_needed > size
+
+        with self._lock:
+            index.sync()
+            files, total = 0, index.total
+            while full():
+                filename = index.pop_first()
+                files += 1
+                try:
+                    os.remove(self.full_name(filename))
+                except FileNotFoundError:
+                    pass
+            if files:
+                index.touch()
+            evicted = total - index.total
+
+        metrics = _metrics
+        if metrics and files:
+            labels = {'cache': self._name}
+            metrics.count('cfgs_cache_evicted_files_total', files, **labels)
+            metrics.count('cfgs_cache_evicted_bytes_total', evicted, **labels)
+
+    def full_name(self, filename):
+        """
+        Return the full name of a file with respect to this cache directory
+        """
+        if not self.shards:
+            return os.path.join(self.dirname, filename)
+
+        digest = hashlib.sha1(filename.encode()).hexdigest()
+        shards = (digest[2 * i:2 * i + 2] for i in range(self.shards))
+        return os.path.join(self.dirname, *shards, filename)
+
+    def _open_hit(self, filename, bin):
+        try:
+            fp = self._open_file(self.full_name(filename), 'r' + bin)
+        except FileNotFoundError:
+            return None
+
+        if self.policy.tracks_access:
+            with self._lock:
+                self.index.sync()
+                self.index.access(filename)
+        return fp
+
+    def _open_file(self, filename, mode):
+        if not self.codec:
+            return open(filename, mode)
+        return self.codec.open(filename, mode if 'b' in mode else mode + 't')
+
+    def _file_lock(self, name, remove=False):
+        if self.atomic:
+            return _FileLock(os.path.join(self.workdir, name), remove)
+        return _NoLock()
+
+
+class CachePolicy:
+    """
+    Decide which entries are evicted first from a `cfgs.CacheDirectory`.
+
+    Each cache entry is given a numeric key whenever it is written or, if
+    `tracks_access` is true, read: the entry with the lowest key is evicted
+    first.
+
+    The default policy evicts the entries that were least recently written.
+    """
+
+    tracks_access = False
+    """If true, record every cache hit in the index"""
+
+    expires = False
+    """If true, entries can expire even if the cache is not full"""
+
+    def key(self, entry):
+        """Return the eviction key for a `cfgs._CacheEntry`"""
+        return entry.created
+
+    def evicted(self, entry):
+        """Called when an entry is removed from the cache"""
+
+    def expired(self, entry, now):
+        """Return True if the entry should be removed now, whatever its size"""
+        return False
+
+
+class LRUPolicy(CachePolicy):
+    """Evict the least recently read or written entries first"""
+
+    tracks_access = True
+
+    def key(self, entry):
+        return entry.accessed
+
+
+class LFUPolicy(CachePolicy):
+    """Evict the least frequently read entries first, then the oldest"""
+
+    tracks_access = True
+
+    def key(self, entry):
+        return entry.hits, entry.accessed
+
+
+class GreedyDualSizePolicy(CachePolicy):
+    """
+    GreedyDual-Size: prefer to evict large entries, and entries that have
+    not been read since many other entries were evicted.
+
+    Each entry's key is `L + cost / size`, where `L` rises to the key of each
+    entry as it is evicted.
+    """
+
+    tracks_access = True
+
+    def __init__(self, cost=1):
+        self.cost = cost
+        """The cost of recomputing any entry"""
+
+        self.inflation = 0
+        """The `L` value: the key of the last entry to be evicted"""
+
+    def key(self, entry):
+        return self.inflation + self.cost / max(entry.size, 1)
+
+    def evicted(self, entry):
+        self.inflation = max(self.inflation, entry.key)
+
+
+class TTLPolicy(CachePolicy):
+    """
+    Remove entries more than `ttl` seconds after they were written, and
+    otherwise evict the least recently written entries first.
+    """
+
+    expires = True
+
+    def __init__(self, ttl=86400):
+        self.ttl = ttl
+        """The time to live for each entry, in seconds"""
+
+    def expired(self, entry, now):
+        return entry.created + self.ttl <= now
+
+
+CACHE_POLICIES = {
+    'gds': GreedyDualSizePolicy,
+    'lfu': LFUPolicy,
+    'lru': LRUPolicy,
+    'mtime': CachePolicy,
+    'ttl': TTLPolicy,
+}
+"""Map names to `cfgs.CachePolicy` classes"""
+
 
-        self.contents = {}
-        """The contents of the formatted file, read and parsed.
+class CacheCodec:
+    """
+    Compress cache files as they are written, and decompress them as they
+    are read, without holding the whole file in memory.
 
-        This will be a `dict` for all formats except `configparser`,
-        where it will be a `configparser.SafeConfigParser`.
-        """
+    `module` is the name of a module like `gzip`, `bz2` or `lzma` whose
+    `open()` function takes a filename and a mode, and returns a streaming
+    file object: any other keyword arguments are passed to `open()`.
+    """
 
-        os.makedirs(os.path.dirname(self.filename), exist_ok=True)
-        self.format = format
-        self.read()
+    def __init__(self, module, **kwargs):
+        self.module = module
+        """The name of the compression module"""
 
-    def read(self):
-        """Re-read the contents from the file"""
-        try:
-            with open(self.filename) as fp:
-                self.contents = self.format.read(fp)
-        except IOError:
-            self.contents = self.format.create()
-        return self.contents
+        self.kwargs = kwargs
+        """Extra arguments to the module's `open()`, like `compresslevel`"""
 
-    def write(self):
-        """Write the contents to the file"""
-        with open(self.filename, 'w') as fp:
-            self.format.write(self.contents, fp)
+    def open(self, filename, mode):
+        """Open a compressed file with a mode like `'rb'` or `'wt'`"""
+        return __import__(self.module).open(filename, mode, **self.kwargs)
 
-    def as_dict(self):
-        """Return a deep copy of the contents as a dict"""
-        return self.format.as_dict(self.contents)
 
-    def clear(self):
-        """Clear the contents without writing"""
-        self.contents.clear()
+CACHE_CODECS = {
+    'bz2': CacheCodec('bz2'),
+    'gzip': CacheCodec('gzip', compresslevel=6),
+    'lzma': CacheCodec('lzma'),
+}
+"""Map names to `cfgs.CacheCodec`s using the standard library"""
+
+
+class _CacheFile:
+    """
+    Wrap a cache file opened for write, and record its final size in the
+    `cfgs._CacheIndex` when it is closed.
+
+    In atomic mode, the file is written to a temporary file which is only
+    renamed into place if it is closed without an exception.
+    """
+
+    def __init__(self, cache, fp, filename, tmp=None, key_lock=None):
+        self._cache = cache
+        self._fp = fp
+        self._filename = filename
+        self._tmp = tmp
+        self._key_lock = key_lock or _NoLock()
+
+    def __getattr__(self, name):
+        return getattr(self._fp, name)
+
+    def __iter__(self):
+        return iter(self._fp)
+
+    def close(self, publish=True):
+        if self._fp.closed:
+            return
+
+        full = self._cache.full_name(self._filename)
+        index = self._cache.index
+        try:
+            self._fp.close()
+            if self._tmp and not publish:
+                os.remove(self._tmp)
+
+            with self._cache._lock:
+                index.sync()
+                if self._tmp and publish:
+                    os.replace(self._tmp, full)
+                    index.touch()
+                try:
+                    index.add(self._filename, os.stat(full).st_size)
+                except FileNotFoundError:
+                    index.remove(self._filename)
+
+                if self._tmp:
+                    # Another process might have evicted our reservation
+                    self._cache.prune()
+        finally:
+            self._key_lock.release()
 
     def __enter__(self):
         return self
 
-    def __exit__(self, *args):
-        self.write()
+    def __exit__(self, exc_type, *args):
+        self.close(publish=exc_type is None)
 
 
-class Cache:
+class _CacheIndex:
     """
-    A class that creates caches
+    A persistent index of the sizes and ages of the files in a cache
+    directory, so that pruning never needs to list or stat the directory.
+
+    The index lives in memory as a dict and a heap ordered by the keys from a
+    `cfgs.CachePolicy`, and is persisted as an append-only journal of JSON
+    lines next to the cache directory.  The journal is compacted when it grows
+    too long, and the index is rebuilt from the directory only if the journal
+    is missing, or older than the directory itself.  The journal is touched
+    after each change that cfgs makes to the directory, so only changes by
+    other programs cause a rebuild.
     """
 
-    def __init__(self, dirname):
-        """Do not call this constructor - instead use `cfgs.App.cache` """
+    COMPACT_SLACK = 64
+    """Compact the journal when it has this many more lines than twice the
+    number of entries"""
 
+    def __init__(self, dirname, policy=None):
+        head, tail = os.path.split(dirname.rstrip('/'))
         self.dirname = dirname
-        """The full path of the root directory for all cache directories"""
+        self.journal = os.path.join(head, '.%s.index' % tail)
+        """The full path to the journal file"""
 
-    def directory(self, name='cache', cache_size=0):
-        """
-        Return a `cfgs.CacheDirectory`
+        self.policy = policy or CachePolicy()
+        """The `cfgs.CachePolicy` which orders the entries"""
 
-        Arguments:
-          name: The relative pathname of the cache directory
+        self.entries = {}
+        """Map filename to `cfgs._CacheEntry`"""
 
-          cache_size: The number of bytes allowed in the cache.
-              The default of 0 means "unlimited cache size"
-        """
-        name = os.path.join(self.dirname, name)
-        return CacheDirectory(name, cache_size)
+        self.total = 0
+        """The sum of the sizes of all entries"""
 
+        self._heap = []
+        self._lines = 0
+        self._seen = self._stamp = None
+        self._count = 0
 
-class CacheDirectory:
-    def __init__(self, dirname, cache_size):
-        """Do not call this constructor - use `cfgs.Cache.directory`"""
+    def sync(self):
+        """Bring the index up to date with the journal and the directory"""
+        try:
+            js = os.stat(self.journal)
+        except FileNotFoundError:
+            return self.rebuild()
 
-        self.dirname = dirname
-        """The full path to this cache directory"""
+        if os.stat(self.dirname).st_mtime_ns > js.st_mtime_ns:
+            return self.rebuild()
 
-        self.cache_size = cache_size
+        stamp = _stamp(js)
+        if stamp == self._stamp:
+            return
+
+        # Each compaction starts the journal with a new header line, so a
+        # reader can tell if the journal it was following has been replaced.
+        with open(self.journal) as fp:
+            header = fp.readline()
+            if self._seen and self._seen[0] == header:
+                fp.seek(self._seen[1])
+            else:
+                self._clear()
+                fp.seek(0)
+            try:
+                for line in fp:
+                    self._replay(*json.loads(line))
+            except ValueError:
+                # A line cut short by a crash or a full disk
+                torn = True
+            else:
+                torn = False
+                self._seen = header, fp.tell()
+
+        if torn:
+            return self.rebuild()
+        self._stamp = stamp
+
+    def touch(self):
         """
-        The number of bytes allowed in the cache.
-        0 means "unlimited cache size"
+        Mark the journal as newer than the directory, after a change that
+        this index already knows about, so that `sync` does not rebuild
         """
+        try:
+            caught_up = self._stamp == _stamp(os.stat(self.journal))
+            os.utime(self.journal)
+        except FileNotFoundError:
+            return
+        if caught_up:
+            self._stamp = _stamp(os.stat(self.journal))
+
+    def rebuild(self):
+        """Rebuild the index from the directory, and rewrite the journal"""
+        self._clear()
+        for root, _, files in os.walk(self.dirname):
+            for f in files:
+                try:
+                    s = os.stat(os.path.join(root, f))
+                except FileNotFoundError:
+                    continue
+                self._set(f, _CacheEntry(s.st_size, s.st_mtime))
+        self.compact()
+
+    def compact(self):
+        """Rewrite the journal with one line per entry"""
+        tmp = '%s.%d.tmp' % (self.journal, os.getpid())
+        items = sorted(self.entries.items(), key=lambda x: x[1].count)
+        header = json.dumps(['#', os.urandom(8).hex()]) + '\n'
+        with open(tmp, 'w') as fp:
+            fp.write(header)
+            for f, e in items:
+                line = '=', f, e.size, e.created, e.accessed, e.hits
+                fp.write(json.dumps(line) + '\n')
+            fp.flush()
+            self._seen = header, fp.tell()
+        os.replace(tmp, self.journal)
+
+        self._heap = [(e.key, e.count, f) for f, e in self.entries.items()]
+        heapq.heapify(self._heap)
+        self._lines = len(self.entries)
+        self._stamp = _stamp(os.stat(self.journal))
+
+    def add(self, filename, size):
+        """Add or replace an entry"""
+        self._record('+', filename, size, time.time())
+
+    def access(self, filename):
+        """Record a cache hit on an entry"""
+        if filename in self.entries:
+            self._record('*', filename, time.time())
+
+    def remove(self, filename):
+        """Remove an entry, if it exists"""
+        if filename in self.entries:
+            self._record('-', filename)
+
+    def expired(self):
+        """Return True if the next entry to be evicted has expired"""
+        if not self.policy.expires:
+            return False
+        first = self._first()
+        return bool(first) and self.policy.expired(first[1], time.time())
+
+    def pop_first(self):
+        """Remove the next entry to be evicted and return its filename"""
+        filename, _ = self._first()
+        self._record('-', filename)
+        return filename
+
+    def _first(self):
+        while self._heap:
+            _, count, filename = self._heap[0]
+            entry = self.entries.get(filename)
+            if entry and entry.count == count:
+                return filename, entry
+            heapq.heappop(self._heap)
+
+    def _record(self, *line):
+        self._replay(*line)
+        with open(self.journal, 'a') as fp:
+            # Only skip our own line if nobody else has written since we read
+            caught_up = self._seen and self._seen[1] == fp.tell()
+            fp.write(json.dumps(line) + '\n')
+            fp.flush()
+            if caught_up:
+                self._seen = self._seen[0], fp.tell()
+                self._stamp = _stamp(os.fstat(fp.fileno()))
+
+        if self._lines > 2 * len(self.entries) + self.COMPACT_SLACK:
+            self.compact()
+
+    def _replay(self, op, filename, *args):
+        if op == '#':
+            return
+        self._lines += 1
+        if op in '+=':
+            self._set(filename, _CacheEntry(*args))
+        elif op == '*':
+            entry = self.entries.get(filename)
+            if entry:
+                entry.hits += 1
+                entry.accessed = args[0]
+                self._push(filename, entry)
+        else:
+            entry = self.entries.pop(filename, None)
+            if entry:
+                self.total -= entry.size
+                self.policy.evicted(entry)
 
-        _makedirs(self.dirname)
-        self.prune()
+    def _set(self, filename, entry):
+        old = self.entries.get(filename)
+        self.total += entry.size - (old.size if old else 0)
+        self.entries[filename] = entry
+        self._push(filename, entry)
 
-    def open(self, filename, size_guess=0, binary=False):
-        """
-        Open a cached file in this directory.
+    def _push(self, filename, entry):
+        self._count += 1
+        entry.key, entry.count = self.policy.key(entry), self._count
+        heapq.heappush(self._heap, (entry.key, entry.count, filename))
 
-        If the file already exists, it is opened for read.
+    def _clear(self):
+        self.entries.clear()
+        self.total = 0
+        self._heap.clear()
+        self._lines = 0
+        self._seen = self._stamp = None
 
-        Otherwise the cache is pruned and the file is opened for write.
 
-        Arguments:
-          filename: the name of the file, relative to the cache directory
-          size_guess: A guess as to how large the file will be, in bytes
-          binary: if True, the file is opened in binary mode
+def _stamp(stat):
+    return stat.st_ino, stat.st_size, stat.st_mtime_ns
 
-        """
-        if '/' in filename:
-            raise ValueError('Subdirectories are not allowed in caches')
 
-        bin = 'b' if binary else ''
+class _CacheEntry:
+    """The index record for one file in a cache directory"""
 
-        full = os.path.join(self.dirname, filename)
-        if os.path.exists(full):
-            return open(full, 'r' + bin)
+    __slots__ = 'size', 'created', 'accessed', 'hits', 'key', 'count'
 
-        self.prune(size_guess)
-        return open(full, 'w' + bin)
+    def __init__(self, size, created, accessed=None, hits=0):
+        self.size = size
+        self.created = created
+        self.accessed = created if accessed is None else accessed
+        self.hits = hits
+        self.key = self.count = None
 
-    def prune(self, bytes_needed=0):
-        """
-        Prune the cache to generate at least `bytes_needed` of free space,
-        if this is possible.
-        """
-        if not self.cache_size:
-            return
 
-        files = os.listdir(self.dirname)
-        info = {f: os.stat(os.path.join(self.dirname, f)) for f in files}
-        required_size = sum(s.st_size for f, s in info.items()) + bytes_needed
-        if required_size <= self.cache_size:
+class _FileLock:
+    """
+    A reentrant, exclusive lock on a file, shared between processes and
+    between threads.  Only available on systems with `fcntl.flock`.
+
+    If `remove` is true, the lock file is removed when the lock is released.
+    """
+
+    def __init__(self, filename, remove=False):
+        self.filename = filename
+        self.remove = remove
+        self._fd = None
+        self._depth = 0
+        self._owner = None
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        import fcntl
+
+        if self._depth and self._owner == threading.get_ident():
+            self._depth += 1
             return
 
-        # Delete oldest items first
-        for f, s in sorted(info.items(), key=lambda x: x[1].st_mtime):
-            os.remove(os.path.join(self.dirname, f))
-            required_size -= s.st_size
-            if required_size <= self.cache_size:
-                return
+        # Threads sharing this object would otherwise share its descriptor
+        self._lock.acquire()
+        try:
+            while True:
+                fd = os.open(self.filename, os.O_RDWR | os.O_CREAT, 0o644)
+                try:
+                    fcntl.flock(fd, fcntl.LOCK_EX)
+                    if not self.remove or _same_file(fd, self.filename):
+                        break
+                except BaseException:
+                    os.close(fd)
+                    raise
+                # The last holder removed the file while we waited for it
+                os.close(fd)
+        except BaseException:
+            self._lock.release()
+            raise
+        self._fd, self._depth, self._owner = fd, 1, threading.get_ident()
+
+    def release(self):
+        import fcntl
+
+        self._depth -= 1
+        if not self._depth:
+            fd, self._fd, self._owner = self._fd, None, None
+            if self.remove:
+                os.remove(self.filename)
+            fcntl.flock(fd, fcntl.LOCK_UN)
+            os.close(fd)
+            self._lock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *args):
+        self.release()
+
+
+def _same_file(fd, filename):
+    try:
+        s = os.stat(filename)
+    except FileNotFoundError:
+        return False
+    f = os.fstat(fd)
+    return (s.st_dev, s.st_ino) == (f.st_dev, f.st_ino)
+
+
+class _NoLock:
+    def acquire(self):
+        pass
+
+    def release(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+
+ASYNC_WORKERS = 4
+"""The number of worker threads for blocking work from async methods"""
+
+_EXECUTOR = None
+
+
+def _run_async(func, *args):
+    global _EXECUTOR
+    import asyncio
+
+    if _EXECUTOR is None:
+        from concurrent.futures import ThreadPoolExecutor
+
+        _EXECUTOR = ThreadPoolExecutor(ASYNC_WORKERS, 'cfgs')
+
+    loop = asyncio.get_running_loop()
+    return loop.run_in_executor(_EXECUTOR, functools.partial(func, *args))
+
+
+class _AsyncOpen:
+    """The result of `cfgs.CacheDirectory.aopen`"""
+
+    def __init__(self, open, *args):
+        self._open = open
+        self._args = args
+        self._file = None
+
+    def __await__(self):
+        fp = yield from _run_async(self._open, *self._args).__await__()
+        return _AsyncFile(fp)
+
+    async def __aenter__(self):
+        self._file = await self
+        return self._file
+
+    async def __aexit__(self, *args):
+        await self._file.__aexit__(*args)
+
+
+class _AsyncFile:
+    """Wrap an open file so that its blocking methods return Futures"""
+
+    def __init__(self, fp):
+        self.file = fp
+        """The underlying file object"""
+
+    def read(self, *args):
+        return _run_async(self.file.read, *args)
+
+    def write(self, data):
+        return _run_async(self.file.write, data)
+
+    def close(self):
+        return _run_async(self.file.close)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        await _run_async(self.file.__exit__, *args)
 
 
 def _check_filename(filename):
@@ -449,6 +2798,8 @@ SUFFIX_TO_FORMAT = {
     '.cfg': 'configparser',
     '.ini': 'configparser',
     '.json': 'json',
+    '.jsonl': 'jsonl',
+    '.snap': 'snapshot',
     '.toml': 'toml',
     '.yaml': 'yaml',
     '.yml': 'yaml',
@@ -461,6 +2812,8 @@ to `cfgs.FORMAT_TO_SUFFIX`
 FORMAT_TO_SUFFIX = {
     'configparser': '.ini',
     'json': '.json',
+    'jsonl': '.jsonl',
+    'snapshot': '.snap',
     'toml': '.toml',
     'yaml': '.yml',
 }
@@ -473,25 +2826,202 @@ FORMATS = set(SUFFIX_TO_FORMAT.values())
 """A list of all formats that `cfgs` understands."""
 
 
+class ParserBackend:
+    """
+    One implementation of a file format, which is only used if its module
+    can be imported.
+
+    `loads` and `dumps` name the module's functions which convert between
+    text and contents: either may be None for a module which can only read
+    or only write.
+    """
+
+    def __init__(self, module, loads='loads', dumps='dumps', name=None):
+        self.module = module
+        """The name of the parser module"""
+
+        self.name = name or module
+        """The name of this backend"""
+
+        self.can_load = loads is not None
+        """True if this backend can read text"""
+
+        self.can_dump = dumps is not None
+        """True if this backend can write text"""
+
+        self._loads = loads
+        self._dumps = dumps
+        self._imported = None
+
+    def available(self):
+        """Return True if the module for this backend can be imported"""
+        if self._imported is None:
+            try:
+                self._imported = __import__(self.module)
+            except ImportError:
+                self._imported = False
+        return self._imported is not False
+
+    def loads(self, text):
+        """Convert text to contents"""
+        return getattr(self._imported, self._loads)(text)
+
+    def dumps(self, contents):
+        """Convert contents to text"""
+        text = getattr(self._imported, self._dumps)(contents)
+        return text.decode() if isinstance(text, bytes) else text
+
+
+class LibyamlBackend(ParserBackend):
+    """Read and write YAML with the C loader and dumper from libyaml"""
+
+    def __init__(self):
+        super().__init__('yaml', 'load', 'dump', 'libyaml')
+
+    def available(self):
+        """Return True if PyYAML was built with libyaml"""
+        return super().available() and self._imported.__with_libyaml__
+
+    def loads(self, text):
+        """Convert text to contents"""
+        return self._imported.load(text, Loader=self._imported.CSafeLoader)
+
+    def dumps(self, contents):
+        """Convert contents to text"""
+        return self._imported.dump(contents, Dumper=self._imported.CSafeDumper)
+
+
+class OrjsonBackend(ParserBackend):
+    """
+    Read and write JSON with `orjson`, writing non-string keys as strings
+    as `json` does.
+
+    This is not one of the default `cfgs.PARSER_BACKENDS`: unlike `json`,
+    `orjson` reads integers wider than 64 bits as floats and cannot write
+    them, writes NaN and infinities as `null`, and cannot read them.  To use
+    it anyway, `cfgs.PARSER_BACKENDS['json'].insert(0, OrjsonBackend())`
+    """
+
+    def __init__(self):
+        super().__init__('orjson')
+
+    def dumps(self, contents):
+        """Convert contents to text"""
+        orjson = self._imported
+        return orjson.dumps(contents, option=orjson.OPT_NON_STR_KEYS).decode()
+
+
+PARSER_BACKENDS = {
+    'json': [
+        ParserBackend('ujson'),
+        ParserBackend('json'),
+    ],
+    'toml': [
+        ParserBackend('rtoml'),
+        ParserBackend('tomllib', dumps=None),
+        ParserBackend('tomli', dumps=None),
+        ParserBackend('toml'),
+        ParserBackend('tomli_w', loads=None),
+        ParserBackend('tomlkit'),
+    ],
+    'yaml': [
+        LibyamlBackend(),
+        ParserBackend('yaml', 'safe_load', 'safe_dump'),
+    ],
+}
+"""
+Map formats to `cfgs.ParserBackend`s, fastest first: the first one that
+is installed is used.  Each must read and write the same data as the
+standard module for its format.
+"""
+
+
+def parser_backend(format, write=False):
+    """Return the fastest installed `cfgs.ParserBackend` for a format"""
+    backends = [
+        b for b in PARSER_BACKENDS[format]
+        if (b.can_dump if write else b.can_load)
+    ]
+    for backend in backends:
+        if backend.available():
+            return backend
+
+    modules = ', '.join(sorted({b.module for b in backends}))
+    raise ImportError('No module to %s %s: install one of %s' % (
+        'write' if write else 'read', format, modules))
+
+
 class Format:
+    binary = False
+    """True if files in this format are read and written as bytes"""
+
     def __init__(self, format, read_kwds, write_kwds):
         self.name = format
         """The name of this format"""
 
         self._read_kwds = read_kwds or {}
         self._write_kwds = write_kwds or {}
-        self._parser = __import__(format)
+        self._module = None
+        self._backends = {}
+
+    @property
+    def _parser(self):
+        # Parsers are only imported when they are first used
+        if self._module is None:
+            self._module = __import__(self.name)
+        return self._module
+
+    def __getstate__(self):
+        # Modules can't be pickled, so they are imported again when needed
+        return dict(self.__dict__, _module=None, _backends={})
+
+    def _backend(self, write):
+        # Keywords are specific to one module, so they disable the backends
+        if self._write_kwds if write else self._read_kwds:
+            return None
+        if self.name not in PARSER_BACKENDS:
+            return None
+        if write not in self._backends:
+            self._backends[write] = parser_backend(self.name, write)
+        return self._backends[write]
 
     def read(self, fp):
         """Read contents from an open file in this format"""
+        backend = self._backend(False)
+        if backend:
+            return backend.loads(fp.read())
+
         load = getattr(self._parser, 'safe_load', self._parser.load)
         return load(fp, **self._read_kwds)
 
     def write(self, contents, fp):
         """Write contents in this format to an open file"""
+        backend = self._backend(True)
+        if backend:
+            return fp.write(backend.dumps(contents))
+
         dump = getattr(self._parser, 'safe_dump', self._parser.dump)
         return dump(contents, fp, **self._write_kwds)
 
+    def stream(self, fp):
+        """
+        Yield the top-level items of an open file in this format: key, value
+        pairs for a mapping, and values for a list.
+
+        JSON and YAML are parsed one item at a time, so only the current
+        item is in memory.  A YAML stream of several documents yields the
+        items of each document in turn.  Other formats are read all at once.
+        """
+        streamer = _STREAMERS.get(self.name)
+        if streamer:
+            yield from streamer(fp)
+            return
+
+        contents = self.read(fp)
+        if not isinstance(contents, (dict, list)):
+            contents = self.as_dict(contents)
+        yield from contents.items() if isinstance(contents, dict) else contents
+
     def create(self):
         """Return new, empty contents"""
         return {}
@@ -500,13 +3030,26 @@ class Format:
         """Convert the contents to a dict"""
         return copy.deepcopy(contents)
 
+    def snapshot(self, contents):
+        """Return a copy of the contents to compare with `equal` later"""
+        import pickle
+
+        try:
+            return pickle.loads(pickle.dumps(contents, -1))
+        except Exception:
+            return copy.deepcopy(contents)
+
+    def equal(self, contents, snapshot):
+        """Return True if the contents have not changed from a snapshot"""
+        return contents == snapshot
+
 
 class ConfigparserFormat(Format):
     name = 'configparser'
     """The name of the configparser format"""
 
     def __init__(self):
-        self._parser = __import__(self.name)
+        super().__init__(self.name, None, None)
 
     def read(self, fp):
         """Read contents from an open file in this format"""
@@ -526,6 +3069,277 @@ class ConfigparserFormat(Format):
         """Convert the contents to a dict"""
         return {k: dict(v) for k, v in contents.items()}
 
+    def snapshot(self, contents):
+        """Return a copy of the contents to compare with `equal` later"""
+        return self.as_dict(contents)
+
+    def equal(self, contents, snapshot):
+        """Return True if the contents have not changed from a snapshot"""
+        return self.as_dict(contents) == snapshot
+
+
+class SnapshotFormat(Format):
+    """
+    A compact binary format using `marshal`, which is much faster to load
+    than text.  Contents can only hold plain data: dicts, lists, strings,
+    numbers, booleans and None.
+    """
+
+    name = 'snapshot'
+    """The name of the snapshot format"""
+
+    binary = True
+
+    def __init__(self):
+        super().__init__(self.name, None, None)
+
+    def read(self, fp):
+        """Read contents from an open file in this format"""
+        return _snapshot_loads(fp.read(), None)
+
+    def write(self, contents, fp):
+        """Write contents in this format to an open file"""
+        fp.write(_snapshot_dumps(None, contents))
+
+
+class JsonLinesFormat(Format):
+    """
+    JSON Lines, with one JSON value on each line.  The contents are a list
+    of those values, and `stream` reads one line at a time.
+    """
+
+    name = 'jsonl'
+    """The name of the JSON Lines format"""
+
+    def __init__(self):
+        super().__init__(self.name, None, None)
+
+    def read(self, fp):
+        """Read contents from an open file in this format"""
+        return list(self.stream(fp))
+
+    def write(self, contents, fp):
+        """Write contents in this format to an open file"""
+        dumps = parser_backend('json', write=True).dumps
+        for item in contents:
+            fp.write(dumps(item) + '\n')
+
+    def stream(self, fp):
+        """Yield the value on each line of an open file"""
+        loads = parser_backend('json').loads
+        for line in fp:
+            if line.strip():
+                yield loads(line)
+
+    def create(self):
+        """Return new, empty contents"""
+        return []
+
+
+def _stream_json(fp, spans=False):
+    # If `spans` is true, yield the source text of each key of an object
+    # with the start and end offsets of its value, instead of the two values
+    s = _JsonStream(fp)
+    first = s.peek()
+    if spans and first != '{':
+        raise ValueError('Only a JSON object has keys')
+    if first not in ('[', '{'):
+        yield s.value()
+        s.end()
+        return
+
+    s.pos += 1
+    close = ']' if first == '[' else '}'
+    if s.peek() == close:
+        s.pos += 1
+    else:
+        while True:
+            if first == '{':
+                key = s.value()
+                if spans:
+                    start, end = s.span
+                    key = s.buf[s.pos - end + start:s.pos]
+                s.expect(':')
+                value = s.value()
+                yield key, s.span if spans else value
+            else:
+                yield s.value()
+            if s.expect(',' + close) == close:
+                break
+    s.end()
+
+
+def _stream_yaml(fp):
+    import yaml
+
+    # The C parser has no Python composer, so borrow the pure Python one
+    base = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+    loader = type('Loader', (base, yaml.composer.Composer), {})(fp)
+
+    def item():
+        return loader.construct_document(loader.compose_node(None, None))
+
+    try:
+        loader.get_event()  # StreamStartEvent
+        while not loader.check_event(yaml.StreamEndEvent):
+            loader.get_event()  # DocumentStartEvent
+            loader.anchors = {}
+            if loader.check_event(yaml.MappingStartEvent):
+                loader.get_event()
+                while not loader.check_event(yaml.MappingEndEvent):
+                    key = item()
+                    yield key, item()
+                loader.get_event()
+            elif loader.check_event(yaml.SequenceStartEvent):
+                loader.get_event()
+                while not loader.check_event(yaml.SequenceEndEvent):
+                    yield item()
+                loader.get_event()
+            else:
+                yield item()
+            loader.get_event()  # DocumentEndEvent
+    finally:
+        loader.dispose()
+
+
+_STREAMERS = {'json': _stream_json, 'yaml': _stream_yaml}
+
+
+class _KeyIndex:
+    """
+    The byte offsets of the value of each top-level key in a JSON file, kept
+    in a hidden file next to it, so one key can be read without parsing the
+    whole file
+    """
+
+    def __init__(self, stamp, spans):
+        self.stamp = stamp
+        self.spans = spans
+
+    @classmethod
+    def load(cls, fp, filename, index=None):
+        """
+        Return an index for the open binary file `fp`, which is `index`, or
+        the saved index, if either is up to date, or else a new index
+        """
+        s = os.fstat(fp.fileno())
+        stamp = [s.st_ino, s.st_size, s.st_mtime_ns]
+        if index and index.stamp == stamp:
+            return index
+
+        dirname, basename = os.path.split(filename)
+        saved = os.path.join(dirname, '.%s.index' % basename)
+        try:
+            with open(saved) as sp:
+                index = json.load(sp)
+            if index['stamp'] == stamp:
+                return cls(stamp, index['spans'])
+        except (OSError, ValueError, KeyError, TypeError):
+            pass
+
+        # In latin-1, each byte is one character, so offsets are in bytes
+        import io
+
+        text = io.TextIOWrapper(fp, encoding='latin-1', newline='')
+        try:
+            spans = {
+                json.loads(k.encode('latin-1').decode()): v
+                for k, v in _stream_json(text, spans=True)
+            }
+        finally:
+            text.detach()
+
+        data = json.dumps({'stamp': stamp, 'spans': spans})
+        try:
+            _atomic_write(saved, None, _Dumped(False), data)
+        except OSError:
+            pass
+        return cls(stamp, spans)
+
+    def get(self, fp, key, default):
+        """Read the value of one key from the open binary file `fp`"""
+        try:
+            start, end = self.spans[key]
+        except KeyError:
+            return default
+        fp.seek(start)
+        return parser_backend('json').loads(fp.read(end - start).decode())
+
+
+class _JsonStream:
+    """
+    Decode JSON values one at a time from a file, reading more only when
+    a value is not yet complete
+    """
+
+    SIZE = 0x10000
+
+    def __init__(self, fp):
+        self.fp = fp
+        self.buf = ''
+        self.pos = 0
+        self.offset = 0
+        """The offset in the file of the start of `buf`"""
+
+        self.span = None
+        """The start and end offsets in the file of the last value"""
+
+        self._decoder = json.JSONDecoder()
+
+    def peek(self):
+        """Skip whitespace, and return the next character or '' at the end"""
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in ' \t\r\n':
+                self.pos += 1
+            if self.pos < len(self.buf) or not self._fill():
+                return self.buf[self.pos:self.pos + 1]
+
+    def expect(self, chars):
+        """Consume the next character, which must be one of `chars`"""
+        c = self.peek()
+        if not (c and c in chars):
+            msg = 'Expected one of %s' % ' '.join(chars)
+            raise json.JSONDecodeError(msg, self.buf, self.pos)
+        self.pos += 1
+        return c
+
+    def value(self):
+        """Decode the next value"""
+        self.peek()
+        start = self.offset + self.pos
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError:
+                if not self._fill():
+                    raise
+                continue
+
+            # A number at the end of the buffer might continue in the file
+            if end == len(self.buf):
+                pos = self.pos
+                if self._fill():
+                    continue
+                end -= pos
+
+            self.pos = end
+            self.span = start, self.offset + end
+            return value
+
+    def end(self):
+        """Check that nothing but whitespace is left"""
+        if self.peek():
+            msg = 'Extra data'
+            raise json.JSONDecodeError(msg, self.buf, self.pos)
+
+    def _fill(self):
+        # Read at least as much as is buffered, so retries stay linear
+        chunk = self.fp.read(max(self.SIZE, len(self.buf) - self.pos))
+        self.buf = self.buf[self.pos:] + chunk
+        self.offset += self.pos
+        self.pos = 0
+        return chunk
+
 
 def _makedirs(f):  # For Python 2 compatibility
     try:
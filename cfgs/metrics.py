@@ -0,0 +1,220 @@
+"""
+Count and time what `cfgs` does: parsing, file writes, cache hits, misses
+and evictions.
+
+Nothing is recorded until `enable` is called: until then, each hook in
+`cfgs` costs one global lookup.
+
+    from cfgs import metrics
+
+    m = metrics.enable()
+    ...
+    m.dump('/tmp/cfgs.prom')
+
+    with metrics.profile() as m:
+        app.config.open()
+    print(m.as_dict())
+"""
+
+import bisect
+import cfgs
+import contextlib
+import json
+import os
+import threading
+import time
+
+SECONDS = (
+    0.00001, 0.0001, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0,
+)
+"""Histogram buckets for metrics in seconds"""
+
+BYTES = tuple(64 * 4 ** i for i in range(11))
+"""Histogram buckets for metrics in bytes, from 64B to 64MB"""
+
+
+class Metrics:
+    """
+    Counters and histograms, keyed by a name and a dict of labels.
+
+    Histograms whose names end in `_bytes` use the `BYTES` buckets, and all
+    others use `SECONDS`.
+    """
+
+    def __init__(self, parent=None):
+        self.counters = {}
+        """Map (name, labels) to a count"""
+
+        self.histograms = {}
+        """Map (name, labels) to a `cfgs.metrics.Histogram`"""
+
+        self.sinks = []
+        """
+        Callbacks which are called with `(kind, name, value, labels)` for
+        each event, where `kind` is `'counter'` or `'histogram'`
+        """
+
+        self.parent = parent
+        """Another `Metrics` which also receives every event, or None"""
+
+        self._lock = threading.Lock()
+
+    def count(self, name, value=1, **labels):
+        """Add `value` to a counter"""
+        key = name, tuple(sorted(labels.items()))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+        for sink in self.sinks:
+            sink('counter', name, value, labels)
+        if self.parent:
+            self.parent.count(name, value, **labels)
+
+    def observe(self, name, value, **labels):
+        """Record one value in a histogram"""
+        key = name, tuple(sorted(labels.items()))
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                buckets = BYTES if name.endswith('_bytes') else SECONDS
+                histogram = self.histograms[key] = Histogram(buckets)
+            histogram.observe(value)
+        for sink in self.sinks:
+            sink('histogram', name, value, labels)
+        if self.parent:
+            self.parent.observe(name, value, **labels)
+
+    @contextlib.contextmanager
+    def timer(self, name, **labels):
+        """A context manager which records how long its block takes"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def as_dict(self):
+        """Return all the metrics as a dict which can be written as JSON"""
+        with self._lock:
+            counters = [
+                {'name': n, 'labels': dict(k), 'value': v}
+                for (n, k), v in sorted(self.counters.items())
+            ]
+            histograms = [
+                dict(h.as_dict(), name=n, labels=dict(k))
+                for (n, k), h in sorted(self.histograms.items())
+            ]
+        return {'counters': counters, 'histograms': histograms}
+
+    def prometheus(self):
+        """Return all the metrics in the Prometheus text format"""
+        d = self.as_dict()
+        lines = []
+        types = set()
+
+        def add_type(name, kind):
+            if name not in types:
+                types.add(name)
+                lines.append('# TYPE %s %s' % (name, kind))
+
+        for c in d['counters']:
+            add_type(c['name'], 'counter')
+            labels = _labels(c['labels'])
+            lines.append('%s%s %s' % (c['name'], labels, c['value']))
+
+        for h in d['histograms']:
+            name, labels = h['name'], h['labels']
+            add_type(name, 'histogram')
+            total = 0
+            for le, n in zip(h['buckets'] + ['+Inf'], h['counts']):
+                total += n
+                le_labels = _labels(dict(labels, le=le))
+                lines.append('%s_bucket%s %d' % (name, le_labels, total))
+            lines.append('%s_sum%s %r' % (name, _labels(labels), h['sum']))
+            lines.append('%s_count%s %d' % (name, _labels(labels), total))
+
+        return ''.join(line + '\n' for line in lines)
+
+    def dump(self, filename):
+        """
+        Atomically write all the metrics to a file: as JSON if its name ends
+        in `.json`, and otherwise in the Prometheus text format
+        """
+        if os.fspath(filename).endswith('.json'):
+            text = json.dumps(self.as_dict(), indent=2)
+        else:
+            text = self.prometheus()
+        filename = os.fspath(filename)
+        cfgs._atomic_write(filename, None, cfgs._Dumped(False), text)
+
+
+class Histogram:
+    """Counts of values in buckets, with their sum"""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        """The upper bounds of each bucket, in increasing order"""
+
+        self.counts = [0] * (len(buckets) + 1)
+        """The count in each bucket, and then in the overflow bucket"""
+
+        self.sum = 0
+        """The sum of all the values"""
+
+    def observe(self, value):
+        """Record one value"""
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    def as_dict(self):
+        """Return the histogram as a dict"""
+        return {
+            'buckets': list(self.buckets),
+            'counts': list(self.counts),
+            'sum': self.sum,
+        }
+
+
+def enable(metrics=None):
+    """
+    Start recording metrics, into `metrics` or a new `Metrics`, and return
+    it
+    """
+    cfgs._metrics = Metrics() if metrics is None else metrics
+    return cfgs._metrics
+
+
+def disable():
+    """Stop recording metrics"""
+    cfgs._metrics = None
+
+
+def current():
+    """Return the `Metrics` which is recording, or None"""
+    return cfgs._metrics
+
+
+@contextlib.contextmanager
+def profile():
+    """
+    A context manager which records the metrics for its block in a new
+    `Metrics`, which is passed on to any `Metrics` that was already
+    recording
+    """
+    previous = cfgs._metrics
+    metrics = enable(Metrics(parent=previous))
+    try:
+        yield metrics
+    finally:
+        cfgs._metrics = previous
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    items = ('%s="%s"' % (k, _escape(v)) for k, v in sorted(labels.items()))
+    return '{%s}' % ','.join(items)
+
+
+def _escape(value):
+    s = str(value)
+    return s.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
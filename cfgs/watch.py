@@ -0,0 +1,179 @@
+"""
+Watch config files, and reload a `cfgs.Configs` when they change.
+
+Where inotify is available, changes are noticed as soon as they happen.
+Otherwise, each file is polled with `os.stat`, comparing its inode, size and
+modification time, so unchanged files are never re-read or re-parsed.
+"""
+
+from . import Configs, _load, _stamp_of
+from pathlib import Path
+import copy
+import os
+import sys
+import threading
+
+
+class Watcher:
+    """
+    Watch a list of config files that are loaded, in order, on top of a
+    `cfgs.Configs`, and apply the changes when any of them changes.
+    """
+
+    def __init__(self, configs: Configs, *files, interval=1.0, inotify=True):
+        """
+        Arguments:
+          configs: The `cfgs.Configs` to keep up to date.  Its current values
+              are the defaults which the files are loaded on top of
+
+          files: The config files, in the order they are loaded
+
+          interval: How often to poll the files, in seconds
+
+          inotify: If True, use inotify where it is available, instead
+              of polling
+        """
+        self.configs = configs
+        """The `cfgs.Configs` being kept up to date"""
+
+        self.files = [Path(f) for f in files]
+        """The config files being watched"""
+
+        self.interval = interval
+        """How often to poll the files, in seconds"""
+
+        self.callbacks = []
+        """Functions called with the `cfgs.Configs.diff` of each change"""
+
+        self._base = copy.deepcopy(configs)
+        self._stats = {}
+        self._contents = {}
+        self._inotify = inotify
+        self._thread = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self.check()
+
+    def subscribe(self, callback):
+        """Call `callback(diff)` after each change: usable as a decorator"""
+        self.callbacks.append(callback)
+        return callback
+
+    def check(self):
+        """
+        Re-read any files that have changed, apply any changes to
+        `configs` and call the callbacks.  Return the diff, which is empty
+        if nothing changed.
+        """
+        with self._lock:
+            changed = False
+            for f in self.files:
+                stat = _stamp_of(f)
+                if stat != self._stats.get(f, ()):
+                    self._contents[f] = stat and _load(f)
+                    self._stats[f] = stat
+                    changed = True
+
+            if not changed:
+                return {}
+
+            configs = copy.deepcopy(self._base)
+            for f in self.files:
+                if self._contents[f]:
+                    configs.copy_from(**self._contents[f])
+
+            diff = self.configs.diff(configs)
+            if diff:
+                self.configs.copy_from(**diff)
+
+        if diff:
+            for callback in self.callbacks:
+                callback(diff)
+        return diff
+
+    def start(self):
+        """Start watching the files on a daemon thread"""
+        if not self._thread:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """Stop watching the files, and wait for the thread to finish"""
+        if self._thread:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def _run(self):
+        notify = None
+        if self._inotify:
+            try:
+                notify = _Inotify({f.parent for f in self.files})
+            except OSError:
+                pass
+
+        try:
+            while not self._stop.is_set():
+                if notify:
+                    notify.wait(self.interval)
+                else:
+                    self._stop.wait(self.interval)
+                if not self._stop.is_set():
+                    try:
+                        self.check()
+                    except Exception as e:
+                        # Perhaps the file is only partly written: try again
+                        print('Cannot reload configs:', e, file=sys.stderr)
+        finally:
+            if notify:
+                notify.close()
+
+
+class _Inotify:
+    """Wait for changes in directories, using inotify through ctypes"""
+
+    # IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO
+    # | IN_CREATE | IN_DELETE
+    MASK = 0x002 | 0x004 | 0x008 | 0x040 | 0x080 | 0x100 | 0x200
+
+    def __init__(self, dirs):
+        import ctypes
+        import ctypes.util
+
+        try:
+            name = ctypes.util.find_library('c') or 'libc.so.6'
+            libc = ctypes.CDLL(name, use_errno=True)
+            init, add_watch = libc.inotify_init1, libc.inotify_add_watch
+        except (OSError, AttributeError) as e:
+            raise OSError('inotify is not available') from e
+
+        self.fd = init(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+
+        for d in dirs:
+            if add_watch(self.fd, os.fsencode(d), self.MASK) < 0:
+                self.close()
+                raise OSError(ctypes.get_errno(), 'Cannot watch', str(d))
+
+    def wait(self, timeout):
+        """Wait up to `timeout` seconds for any events, and discard them"""
+        import select
+
+        if select.select([self.fd], [], [], timeout)[0]:
+            try:
+                while os.read(self.fd, 0x10000):
+                    pass
+            except BlockingIOError:
+                pass
+
+    def close(self):
+        os.close(self.fd)
@@ -0,0 +1,171 @@
+import cfgs
+import io
+import json
+import pytest
+
+NAN, INF = float('nan'), float('inf')
+
+DOCUMENTS = {
+    'json': (
+        '{"a": 1, "b": [true, false, null], "c": {"d": 2.5, "e": "x\\u00e9"},'
+        ' "f": [], "g": {}, "h": 4611686018427387904, "i": "a/b \\"q\\"",'
+        ' "j": {"1": 1, "2.5": 2, "false": 3, "null": 4},'
+        ' "k": 1180591620717411303424, "l": [NaN, Infinity]}',
+        {
+            'a': 1, 'b': [True, False, None], 'c': {'d': 2.5, 'e': 'xé'},
+            'f': [], 'g': {}, 'h': 4611686018427387904, 'i': 'a/b "q"',
+            'j': {'1': 1, '2.5': 2, 'false': 3, 'null': 4},
+            'k': 1180591620717411303424, 'l': [NAN, INF],
+        },
+        # Written, this must read back as the expected value
+        {'j': {1: 1, 2.5: 2, False: 3, None: 4}},
+    ),
+    'toml': (
+        'a = 1\nb = [true, false]\nf = []\ni = "a/b \\"q\\""\n'
+        '[c]\nd = 2.5\ne = "xé"\n[g]\n',
+        {
+            'a': 1, 'b': [True, False], 'c': {'d': 2.5, 'e': 'xé'},
+            'f': [], 'g': {}, 'i': 'a/b "q"',
+        },
+    ),
+    'yaml': (
+        'a: 1\nb: [true, false, null]\nc: {d: 2.5, e: "xé"}\n'
+        'f: []\ng: {}\nh: 4611686018427387904\ni: a/b "q"\n',
+        {
+            'a': 1, 'b': [True, False, None], 'c': {'d': 2.5, 'e': 'xé'},
+            'f': [], 'g': {}, 'h': 4611686018427387904, 'i': 'a/b "q"',
+        },
+    ),
+}
+
+BACKENDS = [
+    pytest.param(format, backend, id='%s-%s' % (format, backend.name))
+    for format, backends in cfgs.PARSER_BACKENDS.items()
+    for backend in backends
+]
+
+
+def same(a, b):
+    # Like ==, but NaN is equal to itself
+    return json.dumps(a, sort_keys=True) == json.dumps(b, sort_keys=True)
+
+
+@pytest.mark.parametrize('format, backend', BACKENDS)
+def test_conformance(format, backend):
+    if not backend.available():
+        pytest.skip(backend.name + ' is not installed')
+
+    text, expected, *written = DOCUMENTS[format]
+    if backend.can_load:
+        assert same(backend.loads(text), expected)
+
+    if backend.can_dump:
+        dumped = backend.dumps(expected)
+        assert isinstance(dumped, str)
+        assert same(cfgs.parser_backend(format).loads(dumped), expected)
+        if backend.can_load:
+            assert same(backend.loads(dumped), expected)
+
+        for w in written:
+            loaded = cfgs.parser_backend(format).loads(backend.dumps(w))
+            assert same(loaded, {k: expected[k] for k in w})
+
+
+def test_orjson():
+    backend = cfgs.OrjsonBackend()
+    if not backend.available():
+        pytest.skip('orjson is not installed')
+    assert backend not in cfgs.PARSER_BACKENDS['json']
+    assert json.loads(backend.dumps({1: 'a', None: 'b'})) == {
+        '1': 'a', 'null': 'b'
+    }
+
+
+def test_keywords_disable_backends():
+    format = cfgs.Format('json', None, {'indent': 2})
+    fp = io.StringIO()
+    format.write({'a': 1}, fp)
+    assert fp.getvalue() == '{\n  "a": 1\n}'
+    assert format.read(io.StringIO(fp.getvalue())) == {'a': 1}
+
+
+def test_missing_backend(monkeypatch):
+    missing = cfgs.ParserBackend('no_such_module_for_cfgs')
+    monkeypatch.setitem(cfgs.PARSER_BACKENDS, 'json', [missing])
+    with pytest.raises(ImportError) as e:
+        cfgs.parser_backend('json', write=True)
+    assert 'no_such_module_for_cfgs' in str(e.value)
+
+
+@pytest.mark.parametrize('indent', [None, 2])
+def test_stream_json(monkeypatch, indent):
+    monkeypatch.setattr(cfgs._JsonStream, 'SIZE', 5)
+    format = cfgs.Format('json', None, None)
+
+    def stream(value):
+        fp = io.StringIO(json.dumps(value, indent=indent))
+        return list(format.stream(fp))
+
+    d = {'a': 1, 'b': [2, {'c': 'x, y}'}], 'c': 1234567890, 'd': 'é' * 9}
+    assert stream(d) == list(d.items())
+    items = [1, 22222, 3.5e10, None, True, 's,]', {}]
+    assert stream(items) == items
+    assert stream({}) == stream([]) == []
+    assert stream(12345) == [12345]
+
+    for bad in '[1, 2', '{"a" 1}', '[1] x', '':
+        with pytest.raises(ValueError):
+            list(format.stream(io.StringIO(bad)))
+
+
+@pytest.mark.parametrize('libyaml', [False, True])
+def test_stream_yaml(monkeypatch, libyaml):
+    import yaml as pyyaml
+
+    if not libyaml:
+        monkeypatch.delattr(pyyaml, 'CSafeLoader', raising=False)
+    elif not hasattr(pyyaml, 'CSafeLoader'):
+        pytest.skip('libyaml is not installed')
+
+    yaml = cfgs.Format('yaml', None, None)
+    json = cfgs.Format('json', None, None)
+
+    def stream(format, value):
+        fp = io.StringIO()
+        format.write(value, fp)
+        fp.seek(0)
+        return list(format.stream(fp))
+
+    d = {'a': 1, 'b': [1, 2], 'c': {'d': None}, 5: 'x'}
+    assert stream(yaml, d) == list(d.items())
+    d.pop(5)
+    assert stream(yaml, d) == stream(json, d) == [
+        ('a', 1), ('b', [1, 2]), ('c', {'d': None})
+    ]
+    items = [1, 's', {'a': [2]}, [3]]
+    assert stream(yaml, items) == stream(json, items) == items
+    assert stream(yaml, {}) == stream(yaml, []) == []
+    assert stream(yaml, 12345) == [12345]
+
+    text = 'x: &x [1, 2]\ny: *x\n---\n- 2\n---\nb\n'
+    items = list(yaml.stream(io.StringIO(text)))
+    assert items == [('x', [1, 2]), ('y', [1, 2]), 2, 'b']
+    assert list(yaml.stream(io.StringIO(''))) == []
+
+    with pytest.raises(pyyaml.YAMLError):
+        list(yaml.stream(io.StringIO('a: 1\nb: [2\n')))
+
+
+def test_stream_other_formats():
+
+    jsonl = cfgs.JsonLinesFormat()
+    fp = io.StringIO()
+    jsonl.write([{'a': 1}, [2], 'b'], fp)
+    lines = fp.getvalue().splitlines()
+    assert [json.loads(line) for line in lines] == [{'a': 1}, [2], 'b']
+    fp.seek(0)
+    assert list(jsonl.stream(fp)) == [{'a': 1}, [2], 'b']
+
+    ini = cfgs.ConfigparserFormat()
+    items = list(ini.stream(io.StringIO('[s]\nx = 1\n')))
+    assert items == [('DEFAULT', {}), ('s', {'x': '1'})]
@@ -0,0 +1,29 @@
+import cfgs
+import pytest
+
+
+def test_map(tmp_path):
+    cache = cfgs.CacheDirectory(str(tmp_path / 'cache'), 8, policy='lru')
+    with cache.open('blob', binary=True) as fp:
+        fp.write(b'0123')
+    with cache.open('empty', binary=True):
+        pass
+    with cache.open('other', binary=True) as fp:
+        fp.write(b'4567')
+
+    m = cache.map('blob')
+    assert m[1:3] == b'12'
+    assert bytes(cache.map('empty')) == b''
+    with pytest.raises(TypeError):
+        m[0] = 0
+
+    # Mapping counts as an access, so 'other' is evicted first
+    with cache.open('new', size_guess=4, binary=True) as fp:
+        fp.write(b'89ab')
+    assert 'other' not in cache.index.entries
+    assert cache.index.total == 8
+
+    cache.prune(8)
+    assert m[:] == b'0123'
+    with pytest.raises(FileNotFoundError):
+        cache.map('blob')
@@ -0,0 +1,149 @@
+import cfgs
+import multiprocessing
+import os
+import random
+import time
+
+KEYS = 8
+PROCESSES = 8
+ITERATIONS = 40
+
+
+def contents(key):
+    return (key * 1000).encode()
+
+
+def worker(root, seed, cache_size, fills):
+    rnd = random.Random(seed)
+    cache = cfgs.CacheDirectory(root, cache_size, atomic=True)
+    for i in range(ITERATIONS):
+        key = 'key%d' % rnd.randrange(KEYS)
+        with cache.open(key, size_guess=len(contents(key)), binary=True) as f:
+            if 'r' in f.mode:
+                assert f.read() == contents(key), key
+            else:
+                with open(fills, 'a') as fp:
+                    fp.write(key + '\n')
+                f.write(contents(key)[:10])
+                f.flush()
+                f.write(contents(key)[10:])
+
+
+def _run(tmp_path, cache_size):
+    root, fills = str(tmp_path / 'cache'), str(tmp_path / 'fills')
+    ctx = multiprocessing.get_context('fork')
+    args = [(root, i, cache_size, fills) for i in range(PROCESSES)]
+    procs = [ctx.Process(target=worker, args=a) for a in args]
+    for p in procs:
+        p.start()
+    for p in procs:
+        p.join()
+    assert [p.exitcode for p in procs] == [0] * PROCESSES
+    return root, open(fills).read().split()
+
+
+def test_fill_once(tmp_path):
+    root, fills = _run(tmp_path, 0)
+    assert sorted(fills) == sorted(set(fills))
+    assert sorted(fills) == sorted(os.listdir(root))
+
+
+def test_prune_concurrently(tmp_path):
+    cache_size = 3 * len(contents('key0'))
+    root, fills = _run(tmp_path, cache_size)
+    sizes = [os.path.getsize(os.path.join(root, f)) for f in os.listdir(root)]
+    assert sum(sizes) <= cache_size
+    assert all(s == len(contents('key0')) for s in sizes)
+
+
+def test_no_lock_files_left(tmp_path):
+    root, fills = _run(tmp_path, 3 * len(contents('key0')))
+    workdir = str(tmp_path / '.cache.work')
+    assert os.listdir(workdir) == ['.directory']
+
+    cache = cfgs.CacheDirectory(root, 100, atomic=True)
+    for i in range(500):
+        with cache.open('miss%d' % i) as fp:
+            fp.write('x' * 10)
+    assert len(os.listdir(root)) == 10
+    assert os.listdir(workdir) == ['.directory']
+
+
+def test_misses_do_not_rebuild(tmp_path, monkeypatch):
+    rebuilds = []
+    rebuild = cfgs._CacheIndex.rebuild
+
+    def counting_rebuild(self):
+        rebuilds.append(self.dirname)
+        rebuild(self)
+
+    monkeypatch.setattr(cfgs._CacheIndex, 'rebuild', counting_rebuild)
+    for shards in 0, 1:
+        root = str(tmp_path / ('cache%d' % shards))
+        cache = cfgs.CacheDirectory(root, 100, atomic=True, shards=shards)
+        assert len(rebuilds) == 1
+        for i in range(20):
+            with cache.open('miss%d' % i) as fp:
+                time.sleep(0.02)  # Longer than the clock's resolution
+                fp.write('x' * 10)
+        assert len(cache.index.entries) == 10
+        assert rebuilds == [root]
+        rebuilds.clear()
+
+    calls = []
+
+    @cfgs.Cache(str(tmp_path)).memoize(cache_size=1000)
+    def square(x):
+        calls.append(x)
+        time.sleep(0.02)
+        return x * x
+
+    squares = [i * i for i in range(10)]
+    assert [square(i % 10) for i in range(20)] == squares * 2
+    assert calls == list(range(10))
+    assert len(rebuilds) == 1
+
+
+def test_abandoned_write(tmp_path):
+    cache = cfgs.CacheDirectory(str(tmp_path / 'cache'), 0, atomic=True)
+    try:
+        with cache.open('one') as fp:
+            fp.write('partial')
+            raise ValueError
+    except ValueError:
+        pass
+    assert os.listdir(cache.dirname) == []
+    assert 'one' not in cache.index.entries
+
+    with cache.open('one') as fp:
+        fp.write('complete')
+    assert cache.open('one').read() == 'complete'
+
+
+def journal_worker(filename, i):
+    format = cfgs.Format('json', {}, {})
+    for j in range(ITERATIONS):
+        f = cfgs.File(filename, format, journal=True)
+        f.COMPACT_BYTES = 0
+        f.contents['%d.%d' % (i, j)] = j
+        f.write()
+        if f._compactor:
+            f._compactor.join()
+
+
+def test_journal_many_writers(tmp_path):
+    filename = str(tmp_path / 'data.json')
+    ctx = multiprocessing.get_context('fork')
+    procs = [
+        ctx.Process(target=journal_worker, args=(filename, i))
+        for i in range(PROCESSES)
+    ]
+    for p in procs:
+        p.start()
+    for p in procs:
+        p.join()
+    assert [p.exitcode for p in procs] == [0] * PROCESSES
+
+    format = cfgs.Format('json', {}, {})
+    contents = cfgs.File(filename, format, journal=True).contents
+    assert len(contents) == PROCESSES * ITERATIONS
@@ -1,4 +1,9 @@
+import cfgs
 import dataclasses as dc
+import enum
+import json
+import pickle
+import pytest
 from cfgs import Configs
 from typing import List
 
@@ -46,3 +51,302 @@ def test_diff():
 
     assert Everything().diff(e) == {'audio': {'levels': [1.0, 2.0]}}
     assert e.diff(Everything()) == {'audio': {'levels': []}}
+
+
+def test_parse_cache(tmp_path, monkeypatch):
+    parsed = []
+    parse = cfgs._parse
+
+    def counting_parse(p):
+        parsed.append(p.name)
+        return parse(p)
+
+    monkeypatch.setattr(cfgs, '_parse', counting_parse)
+    monkeypatch.setattr(cfgs, '_PARSED', {})
+
+    path = tmp_path / 'configs.json'
+    path.write_text(json.dumps({'audio': {'levels': [1.0]}}))
+
+    e, f = Everything(), Everything()
+    e.load(path)
+    f.load(path)
+    assert parsed == ['configs.json']
+    assert e.audio.levels == f.audio.levels == [1.0]
+    assert e.audio.levels is not f.audio.levels
+
+    path.write_text(json.dumps({'dmx': {'channel': 2}}))
+    e.load(path)
+    assert parsed == ['configs.json'] * 2
+    assert e.dmx.channel == 2
+
+    cache = cfgs.CacheDirectory(str(tmp_path / 'cache'), 0, atomic=True)
+    cfgs.set_parse_cache(cache)
+    try:
+        for i in range(2):
+            monkeypatch.setattr(cfgs, '_PARSED', {})
+            e.load(path)
+    finally:
+        cfgs.set_parse_cache(None)
+
+    assert parsed == ['configs.json'] * 3
+    assert len(cache.index.entries) == 1
+
+
+def test_copy_from():
+    e = Everything()
+    e.copy_from(dmx={'channel': 2}, midi={'name': 'x'})
+    expected = {'dmx': {'channel': 2}, 'midi': {'name': 'x'}}
+    assert Everything().diff(e) == expected
+
+    with pytest.raises(AttributeError):
+        e.copy_from(wombat=1)
+
+
+@dc.dataclass
+class Ambiguous(Configs):
+    midi: Midi = field(Midi)
+    midi_name: str = ''
+    enabled: bool = False
+    rate: float = 1.0
+
+
+def test_load_from_environ(capsys):
+    environ = {
+        'APP_AUDIO_LEVELS': '[1, 2]',
+        'APP_DMX_CHANNEL': '7',
+        'APP_MIDI_NAME': 'midi',
+        'APP_WOMBAT': '1',
+        'OTHER_DMX_CHANNEL': '8',
+    }
+    e = Everything()
+    e.load_from_environ('app', environ)
+    expected = {
+        'audio': {'levels': [1, 2]},
+        'dmx': {'channel': 7},
+        'midi': {'name': 'midi'},
+    }
+    assert Everything().diff(e) == expected
+    assert 'No configs match APP_WOMBAT' in capsys.readouterr().err
+
+    e = Everything()
+    e.load_from_environ('app', {'APP_dmx_Channel': '9'})
+    assert e.dmx.channel == 9
+
+    a = Ambiguous()
+    environ = {'A_MIDI_NAME': 'x', 'A_ENABLED': 'true', 'A_RATE': '2.5'}
+    a.load_from_environ('a_', environ)
+    assert Ambiguous().diff(a) == {'enabled': True, 'rate': 2.5}
+    assert 'More than one config matches' in capsys.readouterr().err
+
+    assert cfgs._plan(Ambiguous).ambiguous == ['midi_name']
+    assert sorted(cfgs._plan(Ambiguous).paths) == [
+        ('enabled',), ('midi', 'channel'), ('midi', 'name'), ('midi_name',),
+        ('rate',),
+    ]
+
+
+def test_snapshot(tmp_path):
+    e = Everything()
+    e.audio.levels[:] = [1.0, 2.0]
+    e.midi.copy_from(channel=3, name='m')
+
+    f = Everything()
+    f.load_snapshot(e.snapshot())
+    assert f == e
+
+    path = tmp_path / 'configs.snap'
+    path.write_bytes(e.snapshot())
+    g = Everything()
+    g.load(path)
+    assert g == e
+
+    with pytest.raises(ValueError, match='stale'):
+        Ambiguous().load_snapshot(e.snapshot())
+
+    with pytest.raises(ValueError, match='Not a cfgs snapshot'):
+        e.load_snapshot(b'{"audio": {}}')
+
+    with pytest.raises(ValueError, match='Configs.load'):
+        cfgs._parse(str(path))
+
+
+class Color(enum.Enum):
+    RED = 1
+    BLUE = 2
+
+
+@dc.dataclass
+class Light(Configs):
+    color: Color = Color.RED
+    level: float = 0.5
+
+
+@dc.dataclass
+class Scene(Configs):
+    light: Light = field(Light)
+    background: Color = Color.RED
+
+
+def test_snapshot_enums():
+    s = Scene()
+    s.copy_from(light={'color': Color.BLUE, 'level': 1.0})
+
+    t = Scene()
+    t.load_snapshot(s.snapshot())
+    assert t == s and t.light.color is Color.BLUE
+
+    t = Scene()
+    t.load_snapshot(s.freeze().snapshot())
+    assert t == s
+
+    plan = cfgs._plan(Scene)
+    assert plan.enums == [(0, Color), (2, Color)]
+    bad = cfgs._snapshot_dumps(plan.version, ('GREEN', 1.0, 'RED'))
+    with pytest.raises(ValueError, match='unknown Color: GREEN'):
+        Scene().load_snapshot(bad)
+
+
+def test_slotted():
+    Slotted = Everything.slotted()
+    assert Everything.slotted() is Slotted
+    assert Slotted.slotted() is Slotted
+    assert Midi.slotted() is type(Slotted().midi)
+
+    e = Slotted()
+    assert not hasattr(e, '__dict__')
+    assert not hasattr(e.midi, '__dict__')
+    assert repr(e).startswith('Everything(audio=Audio(')
+
+    e.copy_from(dmx={'channel': 2}, midi={'name': 'x'})
+    expected = {'dmx': {'channel': 2}, 'midi': {'name': 'x'}}
+    assert Slotted().diff(e) == expected
+
+    e.load_from_environ('app', {'APP_MIDI_CHANNEL': '5'})
+    assert e.midi.channel == 5
+
+    f = Everything()
+    f.load_snapshot(e.snapshot())
+    assert Everything().diff(f) == Slotted().diff(e)
+
+    g = pickle.loads(pickle.dumps(e))
+    assert g == e and type(g.midi) is type(e.midi)
+
+
+@dc.dataclass
+class Base(Configs):
+    name: str = 'base'
+
+    def describe(self):
+        return 'Base ' + self.name
+
+    @property
+    def upper(self):
+        return self.name.upper()
+
+
+class Mixin:
+    def shout(self):
+        return self.describe() + '!'
+
+
+@dc.dataclass
+class Child(Mixin, Base):
+    count: int = 1
+
+    def describe(self):
+        return super().describe() + ' x%d' % self.count
+
+    @property
+    def upper(self):
+        return 'CHILD ' + super().upper
+
+    @classmethod
+    def make(cls):
+        return cls(name='made')
+
+
+def test_inherited_methods():
+    variants = [
+        (Child.slotted(), Base.slotted()),
+        (type(Child().freeze()), type(Base().freeze())),
+    ]
+    for child, base in variants:
+        c = child(name='c', count=2)
+        assert c.describe() == 'Base c x2'
+        assert c.shout() == 'Base c x2!'
+        assert c.upper == 'CHILD C'
+        assert child.make().name == 'made'
+        assert pickle.loads(pickle.dumps(c)) == c
+
+        # Variants are subclasses of each other, not of the original classes
+        assert isinstance(c, base) and not isinstance(c, Base)
+
+    assert Child().describe() == 'Base base x1'
+    assert not hasattr(Base.slotted()(), '__dict__')
+
+
+def test_freeze():
+    e = Everything()
+    e.audio.levels[:] = [1.0]
+    frozen = e.freeze()
+    assert frozen.freeze() is frozen
+    assert not hasattr(frozen, '__dict__')
+    assert Everything().diff(frozen.thaw()) == Everything().diff(e)
+    with pytest.raises(dc.FrozenInstanceError):
+        frozen.midi.channel = 2
+
+    e.audio.levels.append(2.0)
+    assert frozen.audio.levels == (1.0,)
+    assert frozen.thaw().audio.levels == [1.0]
+
+    changed = frozen.evolve(midi={'channel': 2})
+    assert changed.midi.channel == 2 and frozen.midi.channel == 0
+    assert changed.audio is frozen.audio and changed.dmx is frozen.dmx
+    assert changed.midi is not frozen.midi
+
+    with pytest.raises(AttributeError):
+        frozen.evolve(wombat=1)
+
+    thawed = changed.thaw()
+    assert type(thawed) is Everything and type(thawed.midi) is Midi
+    thawed.midi.channel = 3
+    assert changed.midi.channel == 2
+
+
+def test_versioned():
+    versions = cfgs.Versioned(Everything())
+    first = versions.current
+    second = versions.copy_from(dmx={'channel': 4})
+    assert versions.current is second
+    assert first.dmx.channel == 0 and second.dmx.channel == 4
+    assert first.midi is second.midi
+
+    third = versions.copy_from(audio={'levels': [1.0, 2.0]})
+    assert third.audio.levels == (1.0, 2.0) and first.audio.levels == ()
+    assert third.dmx is second.dmx
+    with pytest.raises(AttributeError):
+        third.audio.levels.append(99.0)
+
+    assert pickle.loads(pickle.dumps(third)) == third
+    thawed = third.thaw()
+    assert thawed.audio.levels == [1.0, 2.0] and thawed.dmx.channel == 4
+    g = Everything()
+    g.load_snapshot(third.snapshot())
+    assert g == third.thaw()
+
+
+def test_freeze_data():
+    data = {'a': [1, {'b': 2}], 'c': {'d': {3}}, 'e': 'x'}
+    frozen = cfgs.freeze_data(data)
+    assert frozen == {'a': (1, {'b': 2}), 'c': {'d': frozenset({3})}, 'e': 'x'}
+    with pytest.raises(TypeError):
+        frozen['e'] = 'y'
+
+    data['e'] = 'y'
+    changed = cfgs.freeze_data(data, frozen)
+    assert changed['e'] == 'y' and frozen['e'] == 'x'
+    assert changed['a'] is frozen['a'] and changed['c'] is frozen['c']
+
+    data['e'] = 'x'
+    assert cfgs.freeze_data(data, frozen) is frozen
+    assert cfgs.freeze_data([]) == () and cfgs.freeze_data({}) == {}
@@ -1,7 +1,10 @@
 from pyfakefs.fake_filesystem_unittest import TestCase as FakeTestCase
+import asyncio
 import cfgs
 import json
+import os
 import platform
+import threading
 
 
 class TestCase(FakeTestCase):
@@ -11,6 +14,7 @@ class TestCase(FakeTestCase):
 
     def setUp(self):
         self.setUpPyfakefs()
+        cfgs._LISTINGS.clear()
         cfgs._expandvars, self._expandvars = self.expandvars, cfgs._expandvars
         cfgs._getenv, self._getenv = self.ENV.get, cfgs._getenv
 
@@ -72,6 +76,247 @@ class ConfigTest(TestCase):
             f.clear()
             self.assertEqual(f.as_dict(), {})
 
+    def test_snapshot_format(self):
+        app = cfgs.App('test', format='snapshot')
+        contents = {'a': 1, 'b': [2.5, 'x'], 'c': {'d': None}}
+        with app.config.open() as f:
+            f.contents.update(contents)
+        self.assertEqual(f.filename, '/usr/fake/.config/test/test.snap')
+
+        with app.config.open() as f:
+            self.assertEqual(f.contents, contents)
+
+    def test_freeze(self):
+        with cfgs.App('test').config.open() as f:
+            f.contents.update(a=[1, 2], b={'c': 3})
+            first = f.freeze()
+            f.contents['a'].append(4)
+            second = f.freeze()
+
+        self.assertEqual(first, {'a': (1, 2), 'b': {'c': 3}})
+        self.assertEqual(second['a'], (1, 2, 4))
+        self.assertIs(second['b'], first['b'])
+        self.assertIs(f.freeze(), second)
+
+    def test_open_many(self):
+        data = cfgs.App('test').data
+        names = ['f%d.json' % i for i in range(10)]
+        files = list(data.open_many(names))
+        self.assertEqual(len(files), 10)
+        for f in files:
+            f.contents['name'] = os.path.basename(f.filename)
+        data.write_many(files)
+
+        files = data.open_many(names + ['missing.json'], threads=3)
+        actual = {os.path.basename(f.filename): f.contents for f in files}
+        expected = {n: {'name': n} for n in names}
+        expected['missing.json'] = {}
+        self.assertEqual(actual, expected)
+        self.assertFalse(os.path.exists(data.full_name('missing.json')))
+
+    def test_stream(self):
+        data = cfgs.App('test').data
+        with data.open('big.json') as f:
+            f.contents.update(('k%d' % i, [i] * i) for i in range(100))
+        items = list(data.stream('big.json'))
+        self.assertEqual(items, [('k%d' % i, [i] * i) for i in range(100)])
+        self.assertEqual(list(data.stream('missing.json')), [])
+
+        data = cfgs.App('test', format='jsonl').data
+        with data.open() as f:
+            filename = '/usr/fake/.local/share/test/test.jsonl'
+            self.assertEqual(f.filename, filename)
+            f.contents.extend(range(5))
+        self.assertEqual(list(data.stream()), list(range(5)))
+
+    def test_lazy(self):
+        config = cfgs.App('test').config
+        f = config.open(lazy=True)
+        self.assertFalse(f.dirty)
+        f.contents = {'a': 1, 'b': {'c': 'é'}, 'd': [1, 2.5, None]}
+        self.assertTrue(f.dirty)
+        f.write()
+
+        f = config.open(lazy=True)
+        self.assertEqual(f.get('b'), {'c': 'é'})
+        self.assertEqual(f.get('d'), [1, 2.5, None])
+        self.assertEqual(f.get('x', 3), 3)
+        self.assertIs(f._contents, cfgs._NONE)
+        index = '/usr/fake/.config/test/.test.json.index'
+        self.assertTrue(os.path.exists(index))
+
+        # A new File uses the saved index without parsing the file again
+        stream = cfgs._stream_json
+        cfgs._stream_json = None
+        try:
+            self.assertEqual(config.open(lazy=True).get('a'), 1)
+        finally:
+            cfgs._stream_json = stream
+
+        # The index is rebuilt when the file changes
+        with config.open() as g:
+            g.contents['a'] = 'longer'
+        self.assertEqual(f.get('a'), 'longer')
+        self.assertEqual(f.get('d'), [1, 2.5, None])
+
+        self.assertEqual(f.contents['a'], 'longer')
+        self.assertFalse(f.dirty)
+
+    def test_dirty(self):
+        app = cfgs.App('test')
+        with app.config.open() as f:
+            self.assertFalse(f.dirty)
+        self.assertFalse(self.fs.exists(f.filename))
+
+        with app.config.open() as f:
+            f.contents['foo'] = {'bar': [1]}
+            self.assertTrue(f.dirty)
+        self.assertTrue(self.fs.exists(f.filename))
+
+        mtime = self.fs.stat(f.filename).st_mtime_ns
+        self.fs.utime(f.filename, ns=(mtime - 1000, mtime - 1000))
+        with app.config.open() as f:
+            f.contents['foo']['bar'][0] = 1
+        self.assertEqual(self.fs.stat(f.filename).st_mtime_ns, mtime - 1000)
+
+        with app.config.open() as f:
+            f.contents['foo']['bar'].append(2)
+        with app.config.open() as f:
+            self.assertEqual(f.contents, {'foo': {'bar': [1, 2]}})
+
+    def test_journal(self):
+        app = cfgs.App('test', format='yaml')
+        with app.data.open('big', journal=True) as f:
+            f.contents.update(one=1, two=[2], three='three')
+        self.assertFalse(self.fs.exists(f.filename))
+        self.assertEqual(len(open(f.journal).readlines()), 3)
+
+        with app.data.open('big', journal=True) as f:
+            expected = {'one': 1, 'two': [2], 'three': 'three'}
+            self.assertEqual(f.contents, expected)
+            f.contents['two'].append(3)
+            del f.contents['one']
+        self.assertEqual(len(open(f.journal).readlines()), 5)
+
+        f.compact()
+        self.assertFalse(self.fs.exists(f.journal))
+        with app.data.open('big') as g:
+            self.assertEqual(g.contents, {'two': [2, 3], 'three': 'three'})
+
+        f.COMPACT_BYTES = 0
+        f.contents['four'] = 'x' * 100
+        f.write()
+        f._compactor.join()
+        self.assertFalse(self.fs.exists(f.journal))
+        self.assertEqual(app.data.open('big').contents['four'], 'x' * 100)
+
+    def test_compact_without_journal(self):
+        with cfgs.App('test').data.open('x') as f:
+            f.contents['a'] = 1
+        f.compact()
+        f.compact(wait=False)
+        self.assertEqual(self.fs.listdir(os.path.dirname(f.filename)), ['x'])
+
+    def test_journal_two_writers(self):
+        app = cfgs.App('test')
+        a = app.data.open('x', journal=True)
+        b = app.data.open('x', journal=True)
+
+        b.contents['from_b'] = 1
+        b.write()
+
+        a.COMPACT_BYTES = 0
+        a.contents['from_a'] = 2
+        a.write()
+        a._compactor.join()
+        self.assertFalse(self.fs.exists(a.journal))
+
+        b.contents['from_b'] = 3
+        b.write()
+        b.compact()
+
+        with open(a.filename) as fp:
+            self.assertEqual(json.load(fp), {'from_a': 2, 'from_b': 3})
+        self.assertEqual(app.data.open('x', journal=True).contents,
+                         {'from_a': 2, 'from_b': 3})
+
+    def test_journal_interrupted_compaction(self):
+        app = cfgs.App('test')
+        with app.data.open('x', journal=True) as f:
+            f.contents['one'] = 1
+        os.replace(f.journal, f.journal + '.old')
+        with app.data.open('x', journal=True) as f:
+            f.contents['two'] = 2
+
+        f.compact()
+        self.assertFalse(self.fs.exists(f.journal + '.old'))
+        self.assertEqual(app.data.open('x').contents, {'one': 1})
+        f.compact()
+        self.assertEqual(app.data.open('x').contents, {'one': 1, 'two': 2})
+
+    def test_atomic_write(self):
+        app = cfgs.App('test', sync='directory')
+        with app.config.open() as f:
+            f.contents['foo'] = 'bar'
+
+        f = app.config.open()
+        f.contents['bad'] = object()
+        with self.assertRaises(TypeError):
+            f.write()
+
+        self.assertEqual(app.config.open().contents, {'foo': 'bar'})
+        self.assertEqual(self.fs.listdir(app.config.home), ['test.json'])
+
+        with self.assertRaises(ValueError):
+            cfgs.App('test', sync='wombat').config.open()
+
+    def test_write_through_symlink(self):
+        for sync in None, cfgs.GroupCommit(window=0):
+            app = cfgs.App('test', sync=sync)
+            target = '/usr/fake/dotfiles/test.json'
+            self.fs.create_file(target, contents='{}')
+            link = '/usr/fake/.config/test/test.json'
+            self.fs.create_symlink(link, target)
+
+            with app.config.open() as f:
+                f.contents['foo'] = 'bar'
+
+            self.assertTrue(os.path.islink(link))
+            with open(target) as fp:
+                self.assertEqual(json.load(fp), {'foo': 'bar'})
+            self.assertEqual(self.fs.listdir('/usr/fake/dotfiles'),
+                             ['test.json'])
+            self.fs.remove(link)
+            self.fs.remove(target)
+
+    def test_group_commit(self):
+        synced = []
+        fsync, cfgs._fsync = cfgs._fsync, synced.append
+        try:
+            app = cfgs.App('test', sync=cfgs.GroupCommit(window=0.2))
+            files = [app.data.open('f%d' % i) for i in range(8)]
+
+            def write(f, i):
+                f.contents['i'] = i
+                f.write()
+
+            threads = [
+                threading.Thread(target=write, args=(f, i))
+                for i, f in enumerate(files) for j in range(2)
+            ]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+        finally:
+            cfgs._fsync = fsync
+
+        self.assertEqual(synced.count(app.data.home), 1)
+        self.assertEqual(len(synced), 9)
+        for i in range(8):
+            self.assertEqual(app.data.open('f%d' % i).contents, {'i': i})
+        self.assertEqual(len(self.fs.listdir(app.data.home)), 8)
+
     def test_kwds(self):
         def object_hook(x):
             print('object_hook', x)
@@ -150,6 +395,35 @@ class AllFilesTest(TestCase):
         expected = ['/etc/xdg/test/wombat.json']
         self.assertEqual(actual, expected)
 
+    def test_index(self):
+        self.fs.create_file('/etc/xdg/test/wombat.json')
+        self.fs.create_dir('/usr/fake/.config/test')
+        for d in '/etc/xdg/test', '/usr/fake/.config/test':
+            os.utime(d, (1, 1))
+
+        config = cfgs.App('test').config
+        config.INDEX_INTERVAL = 0
+        expected = ['/etc/xdg/test/wombat.json']
+        self.assertEqual(list(config.all_files('wombat.json')), expected)
+
+        # The directory's mtime did not change, so the listing is stale
+        self.fs.create_file('/etc/xdg/test/other.json')
+        self.assertEqual(list(config.all_files('other.json')), [])
+        os.utime('/etc/xdg/test', (2, 2))
+        expected = ['/etc/xdg/test/other.json']
+        self.assertEqual(list(config.all_files('other.json')), expected)
+
+        # Writing through a File is seen at once, even within the interval
+        config.INDEX_INTERVAL = 1000
+        expected = ['/etc/xdg/test/wombat.json']
+        self.assertEqual(list(config.all_files('wombat.json')), expected)
+        with config.open('wombat.json') as f:
+            f.contents['a'] = 1
+        expected = [
+            '/usr/fake/.config/test/wombat.json', '/etc/xdg/test/wombat.json'
+        ]
+        self.assertEqual(list(config.all_files('wombat.json')), expected)
+
 
 class CacheTest(TestCase):
     FILE_CONTENTS = (
@@ -213,3 +487,243 @@ class CacheTest(TestCase):
         with cache.open('seven', size_guess=size_guess) as f:
             f.write('7777777')
         return cache, self.fs.listdir(cache.dirname)
+
+    def test_index(self):
+        cache, listdir = self._create_cache(21, True)
+        index = cache.index
+        self.assertEqual(index.total, 18)
+        self.assertEqual(set(index.entries), {'five', 'six', 'seven'})
+        journal = '/usr/fake/.cache/test/.cache.index'
+        self.assertTrue(self.fs.exists(journal))
+
+        cache2 = cfgs.App('test').cache.directory(cache_size=21)
+        cache2.index.sync()
+        sizes = {k: v.size for k, v in index.entries.items()}
+        sizes2 = {k: v.size for k, v in cache2.index.entries.items()}
+        self.assertEqual(sizes, sizes2)
+
+        self.fs.create_file(cache.dirname + '/new', contents='xxxxx')
+        mtime = self.fs.stat(journal).st_mtime_ns + 1000
+        self.fs.utime(cache.dirname, ns=(mtime, mtime))
+        index.sync()
+        self.assertEqual(index.total, 23)
+        self.assertIn('new', index.entries)
+
+        cache.prune()
+        expected = {'six', 'seven', 'new'}
+        self.assertEqual(set(self.fs.listdir(cache.dirname)), expected)
+
+    def test_torn_index(self):
+        cache, listdir = self._create_cache(21, True)
+        with open(cache.index.journal, 'a') as fp:
+            fp.write('["+", "eig')
+
+        cache2 = cfgs.App('test').cache.directory(cache_size=21)
+        sizes = {k: v.size for k, v in cache2.index.entries.items()}
+        self.assertEqual(sizes, {'five': 5, 'six': 6, 'seven': 7})
+        with open(cache.index.journal) as fp:
+            lines = [json.loads(line) for line in fp]
+        self.assertEqual(len(lines), 4)
+
+    def test_lru(self):
+        cache = cfgs.App('test').cache.directory(cache_size=6, policy='lru')
+        for f in 'abc':
+            with cache.open(f) as fp:
+                fp.write('xx')
+        cache.open('a').close()
+        with cache.open('d', size_guess=2) as fp:
+            fp.write('xx')
+        self.assertEqual(set(self.fs.listdir(cache.dirname)), set('acd'))
+
+    def test_lfu(self):
+        cache = cfgs.App('test').cache.directory(cache_size=6, policy='lfu')
+        for f in 'abc':
+            with cache.open(f) as fp:
+                fp.write('xx')
+        for f in 'aabbc':
+            cache.open(f).close()
+        with cache.open('d', size_guess=2) as fp:
+            fp.write('xx')
+        self.assertEqual(set(self.fs.listdir(cache.dirname)), set('abd'))
+
+    def test_gds(self):
+        cache = cfgs.App('test').cache.directory(cache_size=8, policy='gds')
+        for f, size in zip('abc', (1, 5, 2)):
+            with cache.open(f) as fp:
+                fp.write('x' * size)
+        with cache.open('d', size_guess=2) as fp:
+            fp.write('xx')
+        self.assertEqual(set(self.fs.listdir(cache.dirname)), set('acd'))
+
+    def test_ttl(self):
+        policy = cfgs.TTLPolicy(ttl=60)
+        cache = cfgs.App('test').cache.directory(policy=policy)
+        for f in 'ab':
+            with cache.open(f) as fp:
+                fp.write('xx')
+        cache.index.entries['a'].created -= 120
+        cache.prune()
+        self.assertEqual(self.fs.listdir(cache.dirname), ['b'])
+
+    def test_bad_policy(self):
+        with self.assertRaises(ValueError):
+            cfgs.App('test').cache.directory(policy='wombat')
+
+    def test_shards(self):
+        cache = cfgs.App('test').cache.directory(cache_size=6, shards=2)
+        for f in 'abcd':
+            with cache.open(f, size_guess=2) as fp:
+                fp.write('xx')
+
+        self.assertEqual(cache.open('d').read(), 'xx')
+        full = cache.full_name('d')
+        self.assertEqual(full, cache.dirname + '/3c/36/d')
+        self.assertTrue(self.fs.exists(full))
+        self.assertFalse(self.fs.exists(cache.full_name('a')))
+
+        self.fs.remove(cache.index.journal)
+        cache.index.sync()
+        self.assertEqual(set(cache.index.entries), set('bcd'))
+        self.assertEqual(cache.index.total, 6)
+
+    def test_codec(self):
+        for codec in sorted(cfgs.CACHE_CODECS):
+            cache = cfgs.App('test').cache.directory(codec, codec=codec)
+            with cache.open('text') as fp:
+                fp.write('hello ' * 1000)
+            with cache.open('binary', binary=True) as fp:
+                fp.write(b'\0' * 1000)
+
+            self.assertEqual(cache.open('text').read(), 'hello ' * 1000)
+            self.assertEqual(cache.open('binary', binary=True).read(),
+                             b'\0' * 1000)
+
+            sizes = [self.fs.stat(cache.full_name(f)).st_size
+                     for f in ('text', 'binary')]
+            self.assertLess(sum(sizes), 500)
+            self.assertEqual(cache.index.total, sum(sizes))
+            with self.assertRaises(ValueError):
+                cache.map('binary')
+
+    def test_memoize(self):
+        calls = []
+
+        def square(x, offset=0):
+            calls.append(x)
+            return {'square': x * x + offset}
+
+        memoize = cfgs.App('test').cache.memoize
+        first = memoize(name='square', maxsize=2)(square)
+        self.assertEqual(first(3), {'square': 9})
+        self.assertEqual(first(3), {'square': 9})
+        self.assertEqual(first(3, offset=1), {'square': 10})
+        self.assertEqual(calls, [3, 3])
+        self.assertEqual(len(self.fs.listdir(first.directory.dirname)), 2)
+
+        first.cache_clear()
+        self.assertEqual(first(3), {'square': 9})
+        self.assertEqual(calls, [3, 3])
+
+        second = memoize(name='square', maxsize=0)(square)
+        self.assertEqual(second(3), {'square': 9})
+        self.assertEqual(second(4), {'square': 16})
+        self.assertEqual(calls, [3, 3, 4])
+        self.assertEqual(second.__name__, 'square')
+
+    def test_memoize_error(self):
+        @cfgs.App('test').cache.memoize()
+        def fail():
+            raise ValueError
+
+        with self.assertRaises(ValueError):
+            fail()
+        self.assertEqual(self.fs.listdir(fail.directory.dirname), [])
+
+    def test_async(self):
+        async def run():
+            app = cfgs.App('test')
+            async with await app.config.aopen() as f:
+                f.contents['zip'] = 'zap'
+
+            f = await app.config.aopen()
+            self.assertEqual(f.contents, {'zip': 'zap'})
+            f.contents['zip'] = 'zoop'
+            await f.awrite()
+            self.assertEqual(await f.aread(), {'zip': 'zoop'})
+            files = await app.config.aall_files('test.json')
+            self.assertEqual(files, ['/usr/fake/.config/test/test.json'])
+
+            cache = app.cache.directory(cache_size=4)
+            async with cache.aopen('one') as fp:
+                await fp.write('111')
+            async with cache.aopen('one') as fp:
+                self.assertEqual(await fp.read(), '111')
+
+            fp = await cache.aopen('two', size_guess=2)
+            await fp.write('22')
+            await fp.close()
+            await cache.aprune()
+            self.assertEqual(set(cache.index.entries), {'two'})
+
+        asyncio.run(run())
+
+
+class LayersTest(TestCase):
+    def test_layers(self):
+        from test.test_cfgs import Everything
+
+        self.fs.create_file(
+            '/etc/xdg/test/test.json',
+            contents='{"dmx": {"channel": 1}, "midi": {"name": "system"}}',
+        )
+        self.fs.create_file(
+            '/usr/fake/.config/test/test.json',
+            contents='{"midi": {"name": "home"}}',
+        )
+        self.fs.create_file('/extra.json', contents='{"midi": {"channel": 3}}')
+        environ = {'APP_DMX_CHANNEL': '4'}
+
+        layers = cfgs.App('test').config.layers(
+            Everything(), 'test.json', 'app', ['/extra.json'], environ
+        )
+
+        self.assertEqual(layers.get('dmx.channel'), 4)
+        self.assertEqual(layers.source('dmx.channel'), 'environ')
+        self.assertEqual(layers.get('midi.name'), 'home')
+        self.assertEqual(
+            layers.source('midi.name'), '/usr/fake/.config/test/test.json'
+        )
+        self.assertEqual(layers.get(('midi', 'channel')), 3)
+        self.assertEqual(layers.get('audio.levels'), [])
+        self.assertIsNone(layers.source('audio.levels'))
+
+        layers.set('midi.name', 'runtime')
+        self.assertEqual(layers.configs.midi.name, 'runtime')
+        self.assertEqual(layers.source('midi.name'), 'override')
+        self.assertFalse(layers.refresh())
+
+        with open('/usr/fake/.config/test/test.json', 'w') as fp:
+            fp.write('{"midi": {"name": "home2"}, "dmx": {"channel": 5}}')
+        self.fs.remove('/extra.json')
+        self.assertTrue(layers.refresh())
+        self.assertEqual(layers.configs.midi.channel, 0)
+        self.assertEqual(layers.configs.midi.name, 'runtime')
+        self.assertEqual(layers.configs.dmx.channel, 4)
+
+
+def test_many_processes(tmp_path, monkeypatch):
+    monkeypatch.setattr(cfgs, '_getenv', {'XDG_DATA_HOME': str(tmp_path)}.get)
+    data = cfgs.App('test', format='yaml').data
+    names = ['f%d.yml' % i for i in range(6)]
+    files = list(data.open_many(names, processes=2))
+    for f in files:
+        f.contents['items'] = list(range(int(f.filename[-5])))
+    data.write_many(files, processes=2)
+
+    from concurrent.futures import ProcessPoolExecutor
+
+    with ProcessPoolExecutor(2) as pool:
+        files = list(data.open_many(names, processes=pool))
+    actual = sorted(len(f.contents['items']) for f in files)
+    assert actual == list(range(6))
+    assert not any(f.dirty for f in files)
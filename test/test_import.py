@@ -0,0 +1,26 @@
+from pathlib import Path
+import subprocess
+import sys
+
+ROOT = str(Path(__file__).parents[1])
+
+# Modules which are slow to import, and which cfgs only imports on demand
+SLOW = (
+    'copy', 'dataclasses', 'enum', 'hashlib', 'json', 'pathlib', 're',
+    'threading', 'typing', 'yaml',
+)
+
+
+def test_import_is_lazy():
+    code = (
+        'import sys; before = set(sys.modules); import cfgs;'
+        'app = cfgs.App("test", format="yaml"); app.config, app.data;'
+        'print(" ".join(set(sys.modules) - before))'
+    )
+    result = subprocess.run(
+        [sys.executable, '-c', code],
+        cwd=ROOT, stdout=subprocess.PIPE, text=True, check=True,
+    )
+    imported = set(result.stdout.split())
+    assert 'cfgs' in imported
+    assert not imported.intersection(SLOW)
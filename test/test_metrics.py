@@ -0,0 +1,83 @@
+from cfgs import metrics
+import cfgs
+import json
+import os
+import pytest
+
+
+@pytest.fixture
+def app(tmp_path, monkeypatch):
+    env = {'XDG_CONFIG_HOME': str(tmp_path / 'config')}
+    monkeypatch.setattr(cfgs, '_getenv', env.get)
+    monkeypatch.setattr(cfgs, '_metrics', None)
+    return cfgs.App('test')
+
+
+def test_files(app, tmp_path):
+    events = []
+    m = metrics.enable()
+    m.sinks.append(lambda *event: events.append(event))
+
+    with app.config.open() as f:
+        f.contents['a'] = 'x' * 100
+    app.config.open()
+    metrics.disable()
+    app.config.open()
+
+    d = m.as_dict()
+    assert d['counters'] == [
+        {'name': 'cfgs_file_writes_total', 'labels': {}, 'value': 1}
+    ]
+    histograms = {h['name']: h for h in d['histograms']}
+    read = histograms['cfgs_format_read_seconds']
+    assert read['labels'] == {'format': 'json'}
+    assert sum(read['counts']) == 1
+
+    written = histograms['cfgs_file_write_bytes']
+    assert written['sum'] == os.path.getsize(f.filename)
+    assert events[0] == ('counter', 'cfgs_file_writes_total', 1, {})
+
+    m.dump(tmp_path / 'metrics.json')
+    assert json.loads((tmp_path / 'metrics.json').read_text()) == m.as_dict()
+
+    m.dump(tmp_path / 'metrics.prom')
+    lines = (tmp_path / 'metrics.prom').read_text().splitlines()
+    assert lines[:2] == [
+        '# TYPE cfgs_file_writes_total counter',
+        'cfgs_file_writes_total 1',
+    ]
+    assert '# TYPE cfgs_format_read_seconds histogram' in lines
+    assert 'cfgs_format_read_seconds_count{format="json"} 1' in lines
+    assert 'cfgs_file_write_bytes_bucket{le="64"} 0' in lines
+    assert 'cfgs_file_write_bytes_bucket{le="256"} 1' in lines
+
+
+def test_cache(app, tmp_path):
+    cache = cfgs.CacheDirectory(str(tmp_path / 'cache'), 10)
+    outer = metrics.enable()
+    with metrics.profile() as m:
+        for name in 'a', 'a', 'b':
+            with cache.open(name, size_guess=8) as fp:
+                if not isinstance(fp, cfgs._CacheFile):
+                    continue
+                fp.write('x' * 8)
+    assert metrics.current() is outer
+
+    counters = {c['name']: c['value'] for c in m.as_dict()['counters']}
+    assert counters == {
+        'cfgs_cache_hits_total': 1,
+        'cfgs_cache_misses_total': 2,
+        'cfgs_cache_evicted_files_total': 1,
+        'cfgs_cache_evicted_bytes_total': 8,
+    }
+    assert outer.as_dict() == m.as_dict()
+    labels = m.as_dict()['counters'][0]['labels']
+    assert labels == {'cache': 'cache'}
+
+
+def test_timer():
+    m = metrics.Metrics()
+    with m.timer('block_seconds', step='one'):
+        pass
+    (h,) = m.as_dict()['histograms']
+    assert h['labels'] == {'step': 'one'} and h['counts'][0] == 1
@@ -0,0 +1,55 @@
+from cfgs.watch import Watcher
+from test.test_cfgs import Everything
+import json
+import os
+import threading
+
+
+def _write(path, contents):
+    tmp = str(path) + '.tmp'
+    with open(tmp, 'w') as fp:
+        json.dump(contents, fp)
+    os.replace(tmp, path)
+
+
+def test_check(tmp_path):
+    base, user = tmp_path / 'base.json', tmp_path / 'user.json'
+    _write(base, {'dmx': {'channel': 2}, 'midi': {'name': 'base'}})
+
+    e = Everything()
+    watcher = Watcher(e, base, user)
+    assert e.dmx.channel == 2 and e.midi.name == 'base'
+
+    diffs = []
+    watcher.subscribe(diffs.append)
+    assert watcher.check() == {}
+
+    _write(user, {'midi': {'name': 'user', 'channel': 0}})
+    assert watcher.check() == {'midi': {'name': 'user'}}
+    assert e.midi.name == 'user' and e.dmx.channel == 2
+
+    user.unlink()
+    assert watcher.check() == {'midi': {'name': 'base'}}
+    assert diffs == [{'midi': {'name': 'user'}}, {'midi': {'name': 'base'}}]
+
+
+def _test_thread(tmp_path, inotify):
+    path = tmp_path / 'configs.json'
+    _write(path, {'dmx': {'channel': 1}})
+    e = Everything()
+    changed = threading.Event()
+
+    with Watcher(e, path, interval=0.02, inotify=inotify) as watcher:
+        watcher.subscribe(lambda diff: changed.set())
+        _write(path, {'dmx': {'channel': 5}})
+        assert changed.wait(5)
+
+    assert e.dmx.channel == 5
+
+
+def test_inotify(tmp_path):
+    _test_thread(tmp_path, True)
+
+
+def test_polling(tmp_path):
+    _test_thread(tmp_path, False)